@@ -1,12 +1,31 @@
 from flask import Blueprint, request, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
 from .database import get_db
+from .compression import compress
 from .config import Config
+from .ratelimit import rate_limit
+from .idempotency import idempotent
+from .tokens import issue_tokens, token_versions
 
 auth_bp = Blueprint('auth', __name__)
 
+def _login_email():
+    """Rate limit key for login attempts against a single account"""
+    data = request.get_json(silent=True) or {}
+    return str(data.get('email', '')).lower()
+
+def _reissue_tokens(body):
+    """Fresh tokens for a replayed registration, whose stored response has none"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT token_version FROM users WHERE email = %s', (body.get('email'),))
+        user = cursor.fetchone()
+    return issue_tokens(body['email'], user['token_version']) if user else None
+
 @auth_bp.route('/register', methods=['POST'])
+@idempotent('register', secret_fields=('token', 'refresh_token'), reissue=_reissue_tokens)
+@rate_limit('register', 5, 60, key='ip')
 def register():
     data = request.json
     email = data.get('email')
@@ -15,35 +34,45 @@ def register():
     if not email or not password:
         return jsonify({'error': 'Email and password required'}), 400
 
-    with get_db() as conn:
-        cursor = conn.cursor()
+    # Determine role (admin if matching admin email)
+    role = 'admin' if email == Config.ADMIN_EMAIL else 'user'
 
-        # Check if user exists
-        cursor.execute('SELECT id FROM users WHERE email = %s', (email,))
+    # Turn away known emails before paying for the password hash
+    with get_db(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM users WHERE email = %s', (email,))
         if cursor.fetchone():
             return jsonify({'error': 'Email already registered'}), 400
 
-        # Determine role (admin if matching admin email)
-        role = 'admin' if email == Config.ADMIN_EMAIL else 'user'
+    password_hash = generate_password_hash(password)
 
-        # Create user
-        password_hash = generate_password_hash(password)
-        cursor.execute(
-            'INSERT INTO users (email, password_hash, role) VALUES (%s, %s, %s) RETURNING id',
-            (email, password_hash, role)
-        )
-        user_id = cursor.fetchone()['id']
+    with get_db() as conn:
+        cursor = conn.cursor()
 
-        # Create empty questionnaire for user
+        # Create the user and their empty questionnaire in one statement; the
+        # unique email turns a concurrent duplicate (or one the replica has not
+        # seen yet) into "no row" instead of a race
         cursor.execute(
-            'INSERT INTO questionnaires (user_id, answers, image_paths) VALUES (%s, %s, %s)',
-            (user_id, '{}', [])
+            '''
+            WITH new_user AS (
+                INSERT INTO users (email, password_hash, role) VALUES (%s, %s, %s)
+                ON CONFLICT (email) DO NOTHING
+                RETURNING id
+            )
+            INSERT INTO questionnaires (user_id, answers, image_paths)
+            SELECT id, '{}', '{}' FROM new_user
+            RETURNING user_id
+            ''',
+            (email, password_hash, role)
         )
+        if not cursor.fetchone():
+            return jsonify({'error': 'Email already registered'}), 400
 
-    token = create_access_token(identity=email)
-    return jsonify({'token': token, 'role': role, 'email': email}), 201
+    return jsonify({**issue_tokens(email, 0), 'role': role, 'email': email}), 201
 
 @auth_bp.route('/login', methods=['POST'])
+@rate_limit('login', 20, 60, key='ip')
+@rate_limit('login', 5, 60, key=_login_email)
 def login():
     data = request.json
     email = data.get('email')
@@ -54,15 +83,14 @@ def login():
 
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT id, email, password_hash, role FROM users WHERE email = %s', (email,))
+        cursor.execute('SELECT id, email, password_hash, role, token_version FROM users WHERE email = %s', (email,))
         user = cursor.fetchone()
 
         if not user or not check_password_hash(user['password_hash'], password):
             return jsonify({'error': 'Invalid credentials'}), 401
 
-        token = create_access_token(identity=email)
         return jsonify({
-            'token': token,
+            **issue_tokens(email, user['token_version']),
             'role': user['role'],
             'email': user['email']
         }), 200
@@ -72,7 +100,7 @@ def login():
 def get_current_user():
     email = get_jwt_identity()
 
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT id, email, role, selected_baby_id, partner FROM users WHERE email = %s', (email,))
         user = cursor.fetchone()
@@ -90,6 +118,7 @@ def get_current_user():
 
 @auth_bp.route('/change-password', methods=['POST'])
 @jwt_required()
+@rate_limit('change-password', 5, 60, key='user')
 def change_password():
     email = get_jwt_identity()
     data = request.json
@@ -111,14 +140,57 @@ def change_password():
         if not check_password_hash(user['password_hash'], current_password):
             return jsonify({'error': 'Current password is incorrect'}), 401
 
-        # Update to new password
+        # Update to new password and revoke every token issued with the old one
         new_password_hash = generate_password_hash(new_password)
         cursor.execute(
-            'UPDATE users SET password_hash = %s WHERE id = %s',
+            '''
+            UPDATE users
+            SET password_hash = %s, token_version = token_version + 1, token_revoked_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            RETURNING token_version
+            ''',
             (new_password_hash, user['id'])
         )
+        version = cursor.fetchone()['token_version']
 
-        return jsonify({'message': 'Password changed successfully'}), 200
+    token_versions.set_version(email, version)
+
+    # Hand the caller fresh tokens so this session stays signed in
+    return jsonify({'message': 'Password changed successfully', **issue_tokens(email, version)}), 200
+
+@auth_bp.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    """Exchange a refresh token for a new access token"""
+    email = get_jwt_identity()
+    version = get_jwt().get('ver', 0)
+    token = create_access_token(identity=email, additional_claims={'ver': version})
+    return jsonify({'token': token}), 200
+
+@auth_bp.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    """Revoke all access and refresh tokens for the current user"""
+    email = get_jwt_identity()
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            UPDATE users
+            SET token_version = token_version + 1, token_revoked_at = CURRENT_TIMESTAMP
+            WHERE email = %s
+            RETURNING token_version
+            ''',
+            (email,)
+        )
+        user = cursor.fetchone()
+
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+
+    token_versions.set_version(email, user['token_version'])
+    return jsonify({'message': 'Logged out'}), 200
 
 @auth_bp.route('/partner', methods=['POST'])
 @jwt_required()
@@ -144,11 +216,12 @@ def update_partner():
 
 @auth_bp.route('/users', methods=['GET'])
 @jwt_required()
+@compress
 def get_all_users():
     """Admin only: Get all users"""
     email = get_jwt_identity()
 
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
         user = cursor.fetchone()
@@ -1,15 +1,74 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from psycopg2 import errors
+from psycopg2.extras import Json, execute_values
 from .database import get_db
+from .config import Config
+from .compression import compress
+from .personas import personas, PERSONA_COLUMNS
+from .greetings import schedule_greetings
 
 babies_bp = Blueprint('babies', __name__)
 
+# Babies the user has interacted with (through chat sessions or selected baby).
+# Served from the idx_user_babies_active partial index, so the cost depends on
+# the user's own interactions rather than on the size of the babies catalog.
+MY_BABIES_QUERY = '''
+    SELECT b.id, b.name, b.age, b.attributes, b.image_path, b.life_stages
+    FROM user_babies ub
+    JOIN babies b ON b.id = ub.baby_id
+    WHERE ub.user_id = %s
+    AND (ub.has_chat OR ub.is_selected)
+    AND b.is_visible = TRUE
+    ORDER BY ub.baby_id
+'''
+
+def mark_chatted(cursor, user_id, baby_id):
+    """Record that the user has started a chat with the baby"""
+    cursor.execute(
+        '''
+        INSERT INTO user_babies (user_id, baby_id, has_chat)
+        VALUES (%s, %s, TRUE)
+        ON CONFLICT (user_id, baby_id)
+        DO UPDATE SET has_chat = TRUE WHERE NOT user_babies.has_chat
+        ''',
+        (user_id, baby_id)
+    )
+
+def mark_selected(cursor, user_id, baby_id):
+    """Move the user's selected flag to this baby"""
+    cursor.execute(
+        '''
+        WITH cleared AS (
+            UPDATE user_babies SET is_selected = FALSE
+            WHERE user_id = %s AND is_selected AND baby_id <> %s
+        )
+        INSERT INTO user_babies (user_id, baby_id, is_selected)
+        VALUES (%s, %s, TRUE)
+        ON CONFLICT (user_id, baby_id)
+        DO UPDATE SET is_selected = TRUE
+        ''',
+        (user_id, baby_id, user_id, baby_id)
+    )
+
+def is_id(value):
+    """Row ids in request bodies must be plain integers (not booleans or strings)"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def valid_life_stages(life_stages):
+    """Life stages must be a list of objects with an age and a description"""
+    return isinstance(life_stages, list) and all(
+        isinstance(stage, dict) and isinstance(stage.get('age'), str) and isinstance(stage.get('description'), str)
+        for stage in life_stages
+    )
+
 @babies_bp.route('/babies', methods=['GET'])
 @jwt_required()
+@compress
 def get_babies():
     email = get_jwt_identity()
 
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT id, role FROM users WHERE email = %s', (email,))
         user = cursor.fetchone()
@@ -51,10 +110,15 @@ def toggle_baby_visibility():
         if not user or user['role'] != 'admin':
             return jsonify({'error': 'Unauthorized'}), 403
 
-        # Update all babies visibility
-        cursor.execute('UPDATE babies SET is_visible = %s', (is_visible,))
+        # Update all babies visibility; only the ones that change need greetings
+        cursor.execute(
+            'UPDATE babies SET is_visible = %s WHERE is_visible IS DISTINCT FROM %s RETURNING id',
+            (is_visible, is_visible)
+        )
+        shown = [row['id'] for row in cursor.fetchall()] if is_visible else []
 
-        return jsonify({'message': 'Baby visibility updated', 'is_visible': is_visible}), 200
+    schedule_greetings(shown)
+    return jsonify({'message': 'Baby visibility updated', 'is_visible': is_visible}), 200
 
 @babies_bp.route('/babies/selected', methods=['POST'])
 @jwt_required()
@@ -66,33 +130,32 @@ def select_baby():
     if not baby_id:
         return jsonify({'error': 'Baby ID required'}), 400
 
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT id FROM users WHERE email = %s', (email,))
-        user = cursor.fetchone()
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE users SET selected_baby_id = %s WHERE email = %s RETURNING id',
+                (baby_id, email)
+            )
+            user = cursor.fetchone()
 
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
+            if not user:
+                return jsonify({'error': 'User not found'}), 404
 
-        # Verify baby exists
-        cursor.execute('SELECT id FROM babies WHERE id = %s', (baby_id,))
-        if not cursor.fetchone():
-            return jsonify({'error': 'Baby not found'}), 404
+            mark_selected(cursor, user['id'], baby_id)
+    except errors.ForeignKeyViolation:
+        # users.selected_baby_id references babies
+        return jsonify({'error': 'Baby not found'}), 404
 
-        # Update user's selected baby
-        cursor.execute(
-            'UPDATE users SET selected_baby_id = %s WHERE id = %s',
-            (baby_id, user['id'])
-        )
-
-        return jsonify({'message': 'Baby selected successfully', 'baby_id': baby_id}), 200
+    schedule_greetings([baby_id])
+    return jsonify({'message': 'Baby selected successfully', 'baby_id': baby_id}), 200
 
 @babies_bp.route('/babies/selected', methods=['GET'])
 @jwt_required()
 def get_selected_baby():
     email = get_jwt_identity()
 
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT selected_baby_id FROM users WHERE email = %s', (email,))
         user = cursor.fetchone()
@@ -125,27 +188,20 @@ def get_selected_baby():
 
 @babies_bp.route('/babies/my-babies', methods=['GET'])
 @jwt_required()
+@compress
 def get_my_babies():
     """Get babies associated with the current user (selected baby + babies with chat history)"""
     email = get_jwt_identity()
 
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT id, selected_baby_id FROM users WHERE email = %s', (email,))
+        cursor.execute('SELECT id FROM users WHERE email = %s', (email,))
         user = cursor.fetchone()
 
         if not user:
             return jsonify({'error': 'User not found'}), 404
 
-        # Get babies the user has interacted with (through chat sessions or selected baby)
-        cursor.execute('''
-            SELECT DISTINCT b.id, b.name, b.age, b.attributes, b.image_path, b.life_stages
-            FROM babies b
-            LEFT JOIN chat_sessions cs ON b.id = cs.baby_id AND cs.user_id = %s
-            WHERE b.is_visible = TRUE
-            AND (cs.baby_id IS NOT NULL OR b.id = %s)
-            ORDER BY b.id
-        ''', (user['id'], user['selected_baby_id']))
+        cursor.execute(MY_BABIES_QUERY, (user['id'],))
 
         babies = cursor.fetchall()
 
@@ -165,6 +221,62 @@ def create_baby():
     email = get_jwt_identity()
     data = request.json
 
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
+            user = cursor.fetchone()
+
+            if not user or user['role'] != 'admin':
+                return jsonify({'error': 'Unauthorized'}), 403
+
+            name = data.get('name')
+            age = data.get('age')
+            attributes = data.get('attributes', [])
+            image_path = data.get('image_path', '')
+            life_stages = data.get('life_stages', [])
+            user_id = data.get('user_id')  # User to assign baby to
+
+            if not name or not age:
+                return jsonify({'error': 'Name and age required'}), 400
+
+            if not valid_life_stages(life_stages):
+                return jsonify({'error': 'Invalid life stages'}), 400
+
+            cursor.execute(
+                f'''
+                INSERT INTO babies (name, age, attributes, image_path, is_visible, life_stages, user_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                RETURNING {PERSONA_COLUMNS}
+                ''',
+                (name, age, attributes, image_path, False, Json(life_stages), user_id)
+            )
+            baby = cursor.fetchone()
+    except errors.ForeignKeyViolation:
+        # babies.user_id references users
+        return jsonify({'error': 'User not found'}), 404
+
+    personas.compile(baby)
+    if user_id:
+        schedule_greetings([baby['id']])
+    return jsonify({'message': 'Baby created', 'id': baby['id']}), 201
+
+@babies_bp.route('/babies/<int:baby_id>', methods=['PUT'])
+@jwt_required()
+def update_baby(baby_id):
+    """Admin only: Update a baby's persona fields (name, age, attributes, life stages, image)"""
+    email = get_jwt_identity()
+    data = request.json
+
+    updates = {key: data[key] for key in ('name', 'age', 'attributes', 'image_path', 'life_stages') if key in data}
+    if not updates:
+        return jsonify({'error': 'Nothing to update'}), 400
+
+    if 'life_stages' in updates:
+        if not valid_life_stages(updates['life_stages']):
+            return jsonify({'error': 'Invalid life stages'}), 400
+        updates['life_stages'] = Json(updates['life_stages'])
+
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
@@ -173,38 +285,82 @@ def create_baby():
         if not user or user['role'] != 'admin':
             return jsonify({'error': 'Unauthorized'}), 403
 
-        name = data.get('name')
-        age = data.get('age')
-        attributes = data.get('attributes', [])
-        image_path = data.get('image_path', '')
-        user_id = data.get('user_id')  # User to assign baby to
-
-        if not name or not age:
-            return jsonify({'error': 'Name and age required'}), 400
-
-        # If user_id provided, verify user exists
-        if user_id:
-            cursor.execute('SELECT id FROM users WHERE id = %s', (user_id,))
-            if not cursor.fetchone():
-                return jsonify({'error': 'User not found'}), 404
-
+        # Bumping prompt_version retires every cached prompt for the old persona
+        assignments = ', '.join(f'{key} = %s' for key in updates)
         cursor.execute(
-            'INSERT INTO babies (name, age, attributes, image_path, is_visible, user_id) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id',
-            (name, age, attributes, image_path, False, user_id)
+            f'''
+            UPDATE babies SET {assignments}, prompt_version = prompt_version + 1
+            WHERE id = %s
+            RETURNING {PERSONA_COLUMNS}
+            ''',
+            (*updates.values(), baby_id)
         )
-        baby_id = cursor.fetchone()['id']
+        baby = cursor.fetchone()
 
-        return jsonify({'message': 'Baby created', 'id': baby_id}), 201
+        if not baby:
+            return jsonify({'error': 'Baby not found'}), 404
+
+    personas.compile(baby)
+    # Greetings for the old persona are no longer served; generate the new ones
+    schedule_greetings([baby_id])
+    return jsonify({'message': 'Baby updated', 'id': baby_id, 'prompt_version': baby['prompt_version']}), 200
 
 @babies_bp.route('/babies/<int:baby_id>/assign', methods=['POST'])
 @jwt_required()
-def assign_baby_to_user():
+def assign_baby_to_user(baby_id):
     """Admin only: Assign a baby to a user"""
     email = get_jwt_identity()
     data = request.json
-    baby_id = data.get('baby_id')
     user_id = data.get('user_id')
 
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
+            user = cursor.fetchone()
+
+            if not user or user['role'] != 'admin':
+                return jsonify({'error': 'Unauthorized'}), 403
+
+            if not user_id:
+                return jsonify({'error': 'Baby ID and User ID required'}), 400
+
+            # Assign baby to user
+            cursor.execute('UPDATE babies SET user_id = %s WHERE id = %s RETURNING id', (user_id, baby_id))
+            if not cursor.fetchone():
+                return jsonify({'error': 'Baby not found'}), 404
+    except errors.ForeignKeyViolation:
+        # babies.user_id references users
+        return jsonify({'error': 'User not found'}), 404
+
+    schedule_greetings([baby_id])
+    return jsonify({'message': 'Baby assigned to user successfully'}), 200
+
+@babies_bp.route('/babies/assignments', methods=['POST'])
+@jwt_required()
+def assign_babies_batch():
+    """Admin only: Assign many babies to users in one request
+
+    Body: {"assignments": [{"baby_id": 1, "user_id": 2}, ...]}
+    """
+    email = get_jwt_identity()
+    data = request.json
+    assignments = data.get('assignments')
+
+    if not isinstance(assignments, list) or not assignments:
+        return jsonify({'error': 'Assignments required'}), 400
+    if len(assignments) > Config.ADMIN_BATCH_LIMIT:
+        return jsonify({'error': f'At most {Config.ADMIN_BATCH_LIMIT} assignments per request'}), 400
+
+    rows = []
+    for a in assignments:
+        if not isinstance(a, dict) or not is_id(a.get('baby_id')) or not is_id(a.get('user_id')):
+            return jsonify({'error': 'Each assignment needs an integer baby_id and user_id'}), 400
+        rows.append((a['baby_id'], a['user_id']))
+
+    if len({baby_id for baby_id, _ in rows}) != len(rows):
+        return jsonify({'error': 'Each baby can only be assigned once per request'}), 400
+
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
@@ -213,20 +369,112 @@ def assign_baby_to_user():
         if not user or user['role'] != 'admin':
             return jsonify({'error': 'Unauthorized'}), 403
 
-        if not baby_id or not user_id:
-            return jsonify({'error': 'Baby ID and User ID required'}), 400
+        # Validate every pair in one statement
+        missing = execute_values(
+            cursor,
+            '''
+            SELECT v.baby_id, v.user_id, b.id IS NOT NULL AS baby_exists, u.id IS NOT NULL AS user_exists
+            FROM (VALUES %s) AS v(baby_id, user_id)
+            LEFT JOIN babies b ON b.id = v.baby_id
+            LEFT JOIN users u ON u.id = v.user_id
+            WHERE b.id IS NULL OR u.id IS NULL
+            ''',
+            rows,
+            template='(%s::integer, %s::integer)',
+            page_size=len(rows),
+            fetch=True
+        )
 
-        # Verify baby exists
-        cursor.execute('SELECT id FROM babies WHERE id = %s', (baby_id,))
-        if not cursor.fetchone():
-            return jsonify({'error': 'Baby not found'}), 404
+        missing_babies = sorted({m['baby_id'] for m in missing if not m['baby_exists']})
+        missing_users = sorted({m['user_id'] for m in missing if not m['user_exists']})
+        if missing_babies:
+            return jsonify({'error': 'Baby not found', 'baby_ids': missing_babies}), 404
+        if missing_users:
+            return jsonify({'error': 'User not found', 'user_ids': missing_users}), 404
+
+        # Apply them all in one statement
+        changed = execute_values(
+            cursor,
+            '''
+            UPDATE babies AS b SET user_id = v.user_id
+            FROM (VALUES %s) AS v(baby_id, user_id)
+            WHERE b.id = v.baby_id AND b.user_id IS DISTINCT FROM v.user_id
+            RETURNING b.id, b.is_visible
+            ''',
+            rows,
+            template='(%s::integer, %s::integer)',
+            page_size=len(rows),
+            fetch=True
+        )
 
-        # Verify user exists
-        cursor.execute('SELECT id FROM users WHERE id = %s', (user_id,))
-        if not cursor.fetchone():
-            return jsonify({'error': 'User not found'}), 404
+    # Greetings only for visible babies that moved to a new user
+    schedule_greetings([row['id'] for row in changed if row['is_visible']])
+    return jsonify({'message': 'Babies assigned successfully', 'count': len(rows)}), 200
+
+@babies_bp.route('/babies/visibility/batch', methods=['POST'])
+@jwt_required()
+def set_visibility_batch():
+    """Admin only: Show or hide a set of babies
 
-        # Assign baby to user
-        cursor.execute('UPDATE babies SET user_id = %s WHERE id = %s', (user_id, baby_id))
+    Body: {"changes": [{"baby_id": 1, "is_visible": true}, ...]}
+       or {"baby_ids": [1, 2, 3], "is_visible": true}
+    """
+    email = get_jwt_identity()
+    data = request.json
+
+    if 'baby_ids' in data:
+        baby_ids = data.get('baby_ids')
+        if not isinstance(baby_ids, list) or not isinstance(data.get('is_visible'), bool):
+            return jsonify({'error': 'baby_ids list and is_visible required'}), 400
+        changes = [{'baby_id': baby_id, 'is_visible': data['is_visible']} for baby_id in baby_ids]
+    else:
+        changes = data.get('changes')
+
+    if not isinstance(changes, list) or not changes:
+        return jsonify({'error': 'Changes required'}), 400
+    if len(changes) > Config.ADMIN_BATCH_LIMIT:
+        return jsonify({'error': f'At most {Config.ADMIN_BATCH_LIMIT} changes per request'}), 400
+
+    rows = []
+    for c in changes:
+        if not isinstance(c, dict) or not is_id(c.get('baby_id')) or not isinstance(c.get('is_visible'), bool):
+            return jsonify({'error': 'Each change needs an integer baby_id and a boolean is_visible'}), 400
+        rows.append((c['baby_id'], c['is_visible']))
+
+    if len({baby_id for baby_id, _ in rows}) != len(rows):
+        return jsonify({'error': 'Each baby can only be changed once per request'}), 400
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
+        user = cursor.fetchone()
+
+        if not user or user['role'] != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 403
+
+        # Validate ids in one statement
+        cursor.execute(
+            'SELECT array_agg(v.id) AS missing FROM unnest(%s::integer[]) AS v(id) LEFT JOIN babies b ON b.id = v.id WHERE b.id IS NULL',
+            ([baby_id for baby_id, _ in rows],)
+        )
+        missing = cursor.fetchone()['missing']
+        if missing:
+            return jsonify({'error': 'Baby not found', 'baby_ids': sorted(set(missing))}), 404
+
+        changed = execute_values(
+            cursor,
+            '''
+            UPDATE babies AS b SET is_visible = v.is_visible
+            FROM (VALUES %s) AS v(baby_id, is_visible)
+            WHERE b.id = v.baby_id AND b.is_visible IS DISTINCT FROM v.is_visible
+            RETURNING b.id, b.is_visible
+            ''',
+            rows,
+            template='(%s::integer, %s::boolean)',
+            page_size=len(rows),
+            fetch=True
+        )
 
-        return jsonify({'message': 'Baby assigned to user successfully'}), 200
+    # Greetings only for babies that were just shown
+    schedule_greetings([row['id'] for row in changed if row['is_visible']])
+    return jsonify({'message': 'Baby visibility updated', 'count': len(rows)}), 200
@@ -0,0 +1,199 @@
+"""
+Admin change feed over server-sent events.
+
+Row triggers on users, questionnaires, babies and chat_sessions append each
+insert/update/delete to change_log (users.password_hash stripped) and
+pg_notify('changes'). GET /api/admin/changes streams those rows as SSE
+events so dashboards can load once and then apply deltas.
+
+Ordering: change_log rows are read in (txid, id) order and only once every
+transaction with a lower txid has finished (txid below the snapshot xmin),
+so a transaction that commits late can never be skipped by a cursor that
+has already moved past it. The event id is that "txid:id" cursor; clients
+resume with ?cursor= or the Last-Event-ID header.
+
+Clients should open the feed before loading their snapshot: deltas carry
+the full row, so applying one that the snapshot already includes is
+harmless. A `reset` event means the cursor is older than
+CHANGE_LOG_RETENTION_HOURS and the client must reload.
+"""
+
+import json
+import logging
+import select
+import threading
+import time
+import psycopg2
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from .config import Config
+from .database import get_db
+
+logger = logging.getLogger(__name__)
+
+changes_bp = Blueprint('changes', __name__)
+
+CHANNEL = 'changes'
+TABLES = ('users', 'questionnaires', 'babies', 'chat_sessions')
+BATCH_SIZE = 500
+
+class ChangeListener:
+    """One LISTEN connection per process that wakes every open stream on NOTIFY"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def wait(self, generation, timeout):
+        """Block until a notification newer than `generation` arrives or timeout; returns the latest generation"""
+        self._ensure_started()
+        with self._condition:
+            self._condition.wait_for(lambda: self._generation != generation, timeout)
+            return self._generation
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='change-listener', daemon=True)
+                    self._thread.start()
+
+    def _wake(self):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            try:
+                conn = psycopg2.connect(Config.DATABASE_URL)
+                conn.autocommit = True
+                conn.cursor().execute(f'LISTEN {CHANNEL}')
+                # Anything committed while (re)connecting is picked up by the streams' next read
+                self._wake()
+                while True:
+                    if select.select([conn], [], [], 60) != ([], [], []):
+                        conn.poll()
+                        if conn.notifies:
+                            conn.notifies.clear()
+                            self._wake()
+            except psycopg2.Error:
+                logger.exception('Change listener lost its connection, reconnecting')
+                time.sleep(1)
+
+listener = ChangeListener()
+
+def parse_cursor(value):
+    """'<txid>:<id>' -> (txid, id); None for a missing cursor"""
+    if not value:
+        return None
+    try:
+        txid, change_id = value.split(':')
+        return int(txid), int(change_id)
+    except ValueError:
+        raise ValueError('Invalid cursor')
+
+def _event(event, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id else []
+    lines += [f'event: {event}', f'data: {json.dumps(data)}']
+    return '\n'.join(lines) + '\n\n'
+
+def _head(cursor):
+    """Cursor for "now": rows of finished transactions sort before (xmin, 0), later ones after it"""
+    cursor.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS txid')
+    return cursor.fetchone()['txid'], 0
+
+def _read(cursor, position, tables):
+    cursor.execute(
+        '''
+        SELECT id, txid::text::bigint AS txid, table_name, op, row_id, data, created_at
+        FROM change_log
+        WHERE (txid, id) > (%s::text::xid8, %s)
+        AND txid < pg_snapshot_xmin(pg_current_snapshot())
+        AND table_name = ANY(%s)
+        ORDER BY txid, id
+        LIMIT %s
+        ''',
+        (str(position[0]), position[1], list(tables), BATCH_SIZE)
+    )
+    return cursor.fetchall()
+
+def _expired(cursor, position):
+    """Whether the change a cursor points at has been pruned (rows after it may be gone too)"""
+    if not position[1]:
+        return False
+    cursor.execute('SELECT 1 FROM change_log WHERE id = %s', (position[1],))
+    return cursor.fetchone() is None
+
+@changes_bp.route('/changes', methods=['GET'])
+@jwt_required()
+def stream_changes():
+    """Admin only: Server-sent events with row-level changes
+
+    ?tables=users,questionnaires,babies,chat_sessions&cursor=<event id>
+    Events: `ready` (current cursor), `change` ({id, table, op, row_id, row, at}), `reset`.
+    """
+    email = get_jwt_identity()
+    tables = [t for t in request.args.get('tables', ','.join(TABLES)).split(',') if t]
+    if not tables or any(t not in TABLES for t in tables):
+        return jsonify({'error': f'tables must be a subset of {", ".join(TABLES)}'}), 400
+    try:
+        position = parse_cursor(request.args.get('cursor') or request.headers.get('Last-Event-ID'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    with get_db(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
+        user = cursor.fetchone()
+
+        if not user or user['role'] != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 403
+
+        reset = position is not None and _expired(cursor, position)
+        if position is None or reset:
+            position = _head(cursor)
+
+    def generate(position):
+        # Streams end after CHANGE_STREAM_MAX_SECONDS; EventSource reconnects with Last-Event-ID
+        deadline = time.monotonic() + Config.CHANGE_STREAM_MAX_SECONDS
+        cursor_id = f'{position[0]}:{position[1]}'
+        yield 'retry: 3000\n\n'
+        yield _event('reset' if reset else 'ready', {'cursor': cursor_id}, cursor_id)
+
+        generation = listener.generation
+        while time.monotonic() < deadline:
+            with get_db(readonly=True) as conn:
+                rows = _read(conn.cursor(), position, tables)
+
+            for row in rows:
+                position = (row['txid'], row['id'])
+                yield _event('change', {
+                    'id': row['id'],
+                    'table': row['table_name'],
+                    'op': row['op'],
+                    'row_id': row['row_id'],
+                    'row': row['data'],
+                    'at': row['created_at'].isoformat()
+                }, f'{position[0]}:{position[1]}')
+
+            if len(rows) == BATCH_SIZE:
+                continue
+
+            latest = listener.wait(generation, Config.CHANGE_HEARTBEAT_SECONDS)
+            if latest == generation:
+                # Also re-reads, in case a transaction finished without a notification reaching us
+                yield ': keepalive\n\n'
+            generation = latest
+
+    return Response(
+        stream_with_context(generate(position)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
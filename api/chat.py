@@ -1,38 +1,49 @@
-from flask import Blueprint, request, jsonify
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from .database import get_db
+from psycopg2.extras import execute_values
+from .database import get_db, ensure_current_chat_partitions
+from .compression import compress
 from .config import Config
-from anthropic import Anthropic
+from .ratelimit import rate_limit
+from .idempotency import idempotent
+from .usage import usage, quota_status
+from .llm import get_client, chat_model, response_text
+from .summaries import load_context, build_prompt, maybe_schedule_summary
+from .personas import personas, PERSONA_COLUMNS
+from .babies import mark_chatted, is_id
+from .greetings import load_greeting, load_greetings, save_opening_greeting, schedule_greetings
+from .retention import with_archived
 
-chat_bp = Blueprint('chat', __name__)
-
-def get_baby_prompt(baby_name, baby_age, baby_attributes, stage=None):
-    """Load and format the baby chat prompt"""
-    attributes_str = ", ".join(baby_attributes)
-
-    if stage:
-        # Use stage-specific age and description
-        return f"""You are {baby_name} at {stage['age']}. {stage['description']}
+logger = logging.getLogger(__name__)
 
-Your core traits: {attributes_str}.
+chat_bp = Blueprint('chat', __name__)
 
-Respond as {baby_name} at {stage['age']} would - with appropriate language, personality, and behavior for this age.
-Be genuine, stay in character, and keep responses concise and engaging."""
-    else:
-        # Default prompt
-        return f"""You are {baby_name}, a {baby_age} baby with the following traits: {attributes_str}.
+@chat_bp.before_request
+def ensure_partitions():
+    """Chat writes need this month's chat_messages partition; a no-op after the first request of the month"""
+    try:
+        ensure_current_chat_partitions()
+    except Exception:
+        # Usually the partition exists already (created ahead); let the request try
+        logger.exception('Failed to create chat_messages partitions')
 
-Respond as this baby would - with appropriate language, personality, and behavior for their age and attributes.
-Be playful, genuine, and stay in character. Keep responses concise and engaging."""
+def limit_reached(message_count):
+    """Whether a conversation has used up CHAT_MESSAGE_LIMIT (0 means unlimited)"""
+    return bool(Config.CHAT_MESSAGE_LIMIT) and message_count >= Config.CHAT_MESSAGE_LIMIT
 
 @chat_bp.route('/chat/<int:baby_id>', methods=['GET'])
 @jwt_required()
+@compress
 def get_chat_history(baby_id):
     email = get_jwt_identity()
+    stage_index = request.args.get('stage_index', type=int)  # Which persona's greeting to show for an empty chat
 
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         cursor = conn.cursor()
-        cursor.execute('SELECT id FROM users WHERE email = %s', (email,))
+        cursor.execute('SELECT id, role FROM users WHERE email = %s', (email,))
         user = cursor.fetchone()
 
         if not user:
@@ -41,14 +52,15 @@ def get_chat_history(baby_id):
         # Get chat messages
         cursor.execute(
             '''
-            SELECT message, role, created_at
+            SELECT id, message, role, created_at
             FROM chat_messages
             WHERE user_id = %s AND baby_id = %s
-            ORDER BY created_at ASC
+            ORDER BY id ASC
             ''',
             (user['id'], baby_id)
         )
-        messages = cursor.fetchall()
+        # Months past CHAT_RETENTION_DAYS live in the archive
+        messages = with_archived(user['id'], baby_id, cursor.fetchall())
 
         # Get message count
         cursor.execute(
@@ -58,114 +70,320 @@ def get_chat_history(baby_id):
         session = cursor.fetchone()
         message_count = session['message_count'] if session else 0
 
-        return jsonify({
-            'messages': [{
-                'message': m['message'],
-                'role': m['role'],
-                'timestamp': m['created_at'].isoformat()
-            } for m in messages],
-            'message_count': message_count
-        }), 200
+        # Empty chat: show the pre-generated greeting, or generate it for next time
+        # if this is a visible baby the user can chat with (their own; any for admins)
+        greeting, generate = None, False
+        if not messages:
+            greeting = load_greeting(cursor, baby_id, stage_index)
+            if greeting is None:
+                cursor.execute(
+                    'SELECT 1 FROM babies WHERE id = %s AND is_visible AND (user_id = %s OR %s)',
+                    (baby_id, user['id'], user['role'] == 'admin')
+                )
+                generate = cursor.fetchone() is not None
+
+    if generate:
+        schedule_greetings([baby_id])
+
+    return jsonify({
+        'messages': [{
+            'message': m['message'],
+            'role': m['role'],
+            'timestamp': m['created_at'].isoformat()
+        } for m in messages],
+        'greeting': greeting,
+        'message_count': message_count,
+        'message_limit': Config.CHAT_MESSAGE_LIMIT
+    }), 200
 
 @chat_bp.route('/chat/<int:baby_id>', methods=['POST'])
 @jwt_required()
+@idempotent('chat')
+@rate_limit('chat', 10, 60, key='user')
+@rate_limit('chat', 600, 60, key='global')
 def send_message(baby_id):
     email = get_jwt_identity()
     data = request.json
     user_message = data.get('message')
-    stage = data.get('stage')  # Optional stage parameter
+    stage_index = data.get('stage_index')  # Optional index into the baby's life_stages
 
     if not user_message:
         return jsonify({'error': 'Message required'}), 400
 
+    if stage_index is not None and (not isinstance(stage_index, int) or isinstance(stage_index, bool)):
+        return jsonify({'error': 'Invalid stage'}), 400
+
     with get_db() as conn:
         cursor = conn.cursor()
 
         # Get user
-        cursor.execute('SELECT id FROM users WHERE email = %s', (email,))
+        cursor.execute('SELECT id, role, token_quota FROM users WHERE email = %s', (email,))
         user = cursor.fetchone()
         if not user:
             return jsonify({'error': 'User not found'}), 404
 
+        # Monthly token quota (users.token_quota or the role default)
+        quota, used = quota_status(cursor, user)
+        if quota and used >= quota:
+            return jsonify({'error': 'Token quota reached', 'quota_reached': True, 'quota': quota, 'used': used}), 429
+
         # Get baby details
-        cursor.execute('SELECT name, age, attributes FROM babies WHERE id = %s', (baby_id,))
+        cursor.execute(f'SELECT {PERSONA_COLUMNS} FROM babies WHERE id = %s', (baby_id,))
         baby = cursor.fetchone()
         if not baby:
             return jsonify({'error': 'Baby not found'}), 404
 
-        # Check message count
-        cursor.execute(
-            '''
-            INSERT INTO chat_sessions (user_id, baby_id, message_count)
-            VALUES (%s, %s, 0)
-            ON CONFLICT (user_id, baby_id)
-            DO NOTHING
-            ''',
-            (user['id'], baby_id)
-        )
+        # Precompiled persona prompt for this baby and stage
+        try:
+            system_prompt = personas.get(baby, stage_index)
+        except IndexError:
+            return jsonify({'error': 'Invalid stage'}), 400
 
+        # Check message count
         cursor.execute(
             'SELECT message_count FROM chat_sessions WHERE user_id = %s AND baby_id = %s',
             (user['id'], baby_id)
         )
         session = cursor.fetchone()
-        message_count = session['message_count']
+        message_count = session['message_count'] if session else 0
 
-        if message_count >= 20:  # 10 back-and-forths = 20 messages
+        if limit_reached(message_count):
             return jsonify({'error': 'Message limit reached', 'limit_reached': True}), 400
 
-        # Save user message
-        cursor.execute(
-            'INSERT INTO chat_messages (user_id, baby_id, message, role) VALUES (%s, %s, %s, %s)',
-            (user['id'], baby_id, user_message, 'user')
+        # Get chat history for context (summary + recent turns in long mode); a new
+        # conversation opens with the stored greeting, as it will once saved
+        if session:
+            summary, history = load_context(cursor, user['id'], baby_id)
+        else:
+            greeting = load_greeting(cursor, baby_id, stage_index)
+            summary, history = None, [{'message': greeting, 'role': 'assistant'}] if greeting else []
+
+    # Build messages for Claude
+    history = history + [{'message': user_message, 'role': 'user'}]
+    system_prompt, messages = build_prompt(system_prompt, summary, history)
+
+    # Call Claude API with the model configured for this baby and stage; no pooled
+    # connection is held while waiting, and nothing is stored unless it answers
+    model, max_tokens = chat_model(baby_id, stage_index)
+    try:
+        response = get_client().messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            system=system_prompt,
+            messages=messages
         )
+    except Exception as e:
+        return jsonify({'error': f'Failed to get response: {str(e)}'}), 500
+    usage.record(user['id'], baby_id, model, 'chat', response)
+    assistant_message = response_text(response)
+
+    # Save both messages, starting the conversation if this is the first one
+    if not _save_replies(user['id'], user_message, stage_index, [(baby_id, assistant_message, len(history))]):
+        return jsonify({'error': 'Failed to save the reply'}), 500
+
+    new_count = message_count + 2  # user + assistant
+    return jsonify({
+        'message': assistant_message,
+        'message_count': new_count,
+        'limit_reached': limit_reached(new_count)
+    }), 200
+
+def _multi_cost():
+    """Rate limit cost of a multi-baby chat: one per baby asked, like separate requests"""
+    data = request.get_json(silent=True)
+    baby_ids = data.get('baby_ids') if isinstance(data, dict) else None
+    if not isinstance(baby_ids, list) or not baby_ids:
+        return 1
+    return min(len(baby_ids), Config.CHAT_MULTI_MAX_BABIES)
+
+@chat_bp.route('/chat/multi', methods=['POST'])
+@jwt_required()
+@rate_limit('chat', 10, 60, key='user', cost=_multi_cost)
+@rate_limit('chat', 600, 60, key='global', cost=_multi_cost)
+def send_message_multi():
+    """Send one message to several babies at once
+
+    Body: {"message": "...", "baby_ids": [1, 2, 3], "stage_index": null}
+    Streams one JSON object per line (application/x-ndjson) as each reply arrives:
+    {"baby_id", "message", "message_count", "limit_reached"} or {"baby_id", "error"},
+    then {"done": true, "saved": [baby ids]} once every turn is stored.
+    Nothing is written before the model answers: conversations (and their
+    opening greetings) are only started for babies that replied.
+    """
+    email = get_jwt_identity()
+    data = request.json
+    user_message = data.get('message')
+    baby_ids = data.get('baby_ids')
+    stage_index = data.get('stage_index')
+
+    if not user_message:
+        return jsonify({'error': 'Message required'}), 400
+
+    if (not isinstance(baby_ids, list) or not baby_ids or not all(is_id(b) for b in baby_ids)
+            or len(set(baby_ids)) != len(baby_ids)):
+        return jsonify({'error': 'baby_ids must be a list of distinct baby ids'}), 400
+    if len(baby_ids) > Config.CHAT_MULTI_MAX_BABIES:
+        return jsonify({'error': f'At most {Config.CHAT_MULTI_MAX_BABIES} babies per request'}), 400
+
+    if stage_index is not None and (not isinstance(stage_index, int) or isinstance(stage_index, bool)):
+        return jsonify({'error': 'Invalid stage'}), 400
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT id, role, token_quota FROM users WHERE email = %s', (email,))
+        user = cursor.fetchone()
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+
+        cursor.execute(f'SELECT {PERSONA_COLUMNS} FROM babies WHERE id = ANY(%s)', (baby_ids,))
+        babies = {b['id']: b for b in cursor.fetchall()}
+        missing = [baby_id for baby_id in baby_ids if baby_id not in babies]
+        if missing:
+            return jsonify({'error': 'Baby not found', 'baby_ids': missing}), 404
+
+        try:
+            system_prompts = {baby_id: personas.get(babies[baby_id], stage_index) for baby_id in baby_ids}
+        except IndexError:
+            return jsonify({'error': 'Invalid stage'}), 400
+
+        # One token quota covers every reply in the request
+        quota, used = quota_status(cursor, user)
+        if quota and used >= quota:
+            return jsonify({'error': 'Token quota reached', 'quota_reached': True, 'quota': quota, 'used': used}), 429
 
-        # Get chat history for context
         cursor.execute(
-            '''
-            SELECT message, role
-            FROM chat_messages
-            WHERE user_id = %s AND baby_id = %s
-            ORDER BY created_at ASC
-            ''',
-            (user['id'], baby_id)
+            'SELECT baby_id, message_count FROM chat_sessions WHERE user_id = %s AND baby_id = ANY(%s)',
+            (user['id'], baby_ids)
+        )
+        message_counts = {row['baby_id']: row['message_count'] for row in cursor.fetchall()}
+
+        # New conversations open with the stored greeting, as they will once saved
+        new_babies = [baby_id for baby_id in baby_ids if baby_id not in message_counts]
+        greetings = load_greetings(cursor, new_babies, stage_index) if new_babies else {}
+
+        # Prompts for babies still under the message limit; the new turn is stored with the reply
+        jobs = []
+        for baby_id in baby_ids:
+            if baby_id in new_babies:
+                message_counts[baby_id] = 0
+                summary = None
+                history = [{'message': greetings[baby_id], 'role': 'assistant'}] if baby_id in greetings else []
+            elif limit_reached(message_counts[baby_id]):
+                continue
+            else:
+                summary, history = load_context(cursor, user['id'], baby_id)
+            history = history + [{'message': user_message, 'role': 'user'}]
+            system_prompt, messages = build_prompt(system_prompts[baby_id], summary, history)
+            jobs.append((baby_id, system_prompt, messages, len(history)))
+
+    user_id = user['id']
+    replies = []  # (baby_id, text, history length), filled by the worker threads
+
+    def ask(baby_id, system_prompt, messages, turns):
+        model, max_tokens = chat_model(baby_id, stage_index)
+        response = get_client().messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            system=system_prompt,
+            messages=messages
         )
-        history = cursor.fetchall()
+        usage.record(user_id, baby_id, model, 'chat', response)
+        text = response_text(response)
+        replies.append((baby_id, text, turns))
+        return text
+
+    def line(payload):
+        return json.dumps(payload) + '\n'
 
-        # Build messages for Claude
-        system_prompt = get_baby_prompt(baby['name'], baby['age'], baby['attributes'], stage)
-        messages = [{'role': 'user' if h['role'] == 'user' else 'assistant', 'content': h['message']} for h in history]
+    def generate():
+        for baby_id in baby_ids:
+            if limit_reached(message_counts[baby_id]):
+                yield line({'baby_id': baby_id, 'error': 'Message limit reached', 'limit_reached': True})
 
-        # Call Claude API
         try:
-            client = Anthropic(api_key=Config.ANTHROPIC_API_KEY)
-            response = client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=1024,
-                system=system_prompt,
-                messages=messages
-            )
+            # Model calls run concurrently outside any transaction; replies stream in completion order
+            with ThreadPoolExecutor(max_workers=max(1, min(Config.CHAT_MULTI_CONCURRENCY, len(jobs)))) as pool:
+                futures = {pool.submit(ask, *job): job[0] for job in jobs}
+                for future in as_completed(futures):
+                    baby_id = futures[future]
+                    try:
+                        text = future.result()
+                    except Exception as e:
+                        yield line({'baby_id': baby_id, 'error': f'Failed to get response: {str(e)}'})
+                        continue
+                    new_count = message_counts[baby_id] + 2  # user + assistant
+                    yield line({
+                        'baby_id': baby_id,
+                        'message': text,
+                        'message_count': new_count,
+                        'limit_reached': limit_reached(new_count)
+                    })
+        finally:
+            # Runs even if the client disconnected, so replies that were paid for are kept
+            saved = _save_replies(user_id, user_message, stage_index, replies)
 
-            assistant_message = response.content[0].text
+        yield line({'done': True, 'saved': saved})
 
-            # Save assistant message
-            cursor.execute(
-                'INSERT INTO chat_messages (user_id, baby_id, message, role) VALUES (%s, %s, %s, %s)',
-                (user['id'], baby_id, assistant_message, 'assistant')
-            )
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _save_replies(user_id, user_message, stage_index, replies):
+    """Store every answered turn in one insert and bump the counts in one update; returns the saved baby ids
 
-            # Update message count
-            new_count = message_count + 2  # user + assistant
+    Conversations that did not exist yet are started here, with their opening greeting.
+    Summaries are scheduled once the turns are committed.
+    """
+    if not replies:
+        return []
+    answered = [baby_id for baby_id, _, _ in replies]
+
+    rows = []
+    for baby_id, text, _ in replies:
+        rows.append((user_id, baby_id, user_message, 'user'))
+        rows.append((user_id, baby_id, text, 'assistant'))
+
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
             cursor.execute(
-                'UPDATE chat_sessions SET message_count = %s WHERE user_id = %s AND baby_id = %s',
-                (new_count, user['id'], baby_id)
+                '''
+                INSERT INTO chat_sessions (user_id, baby_id, message_count)
+                SELECT %s, baby_id, 0 FROM unnest(%s::integer[]) AS baby_id
+                ON CONFLICT (user_id, baby_id) DO NOTHING
+                RETURNING baby_id
+                ''',
+                (user_id, answered)
             )
+            # Greetings go in first so they stay the opening turn
+            for row in cursor.fetchall():
+                mark_chatted(cursor, user_id, row['baby_id'])
+                save_opening_greeting(cursor, user_id, row['baby_id'], stage_index)
 
-            return jsonify({
-                'message': assistant_message,
-                'message_count': new_count,
-                'limit_reached': new_count >= 20
-            }), 200
+            execute_values(
+                cursor,
+                'INSERT INTO chat_messages (user_id, baby_id, message, role) VALUES %s',
+                rows,
+                page_size=len(rows)
+            )
+            execute_values(
+                cursor,
+                '''
+                UPDATE chat_sessions AS s SET message_count = s.message_count + 2
+                FROM (VALUES %s) AS v(user_id, baby_id)
+                WHERE s.user_id = v.user_id AND s.baby_id = v.baby_id
+                ''',
+                [(user_id, baby_id) for baby_id in answered],
+                template='(%s::integer, %s::integer)',
+                page_size=len(replies)
+            )
+    except Exception:
+        logger.exception('Failed to save chat replies')
+        return []
 
-        except Exception as e:
-            return jsonify({'error': f'Failed to get response: {str(e)}'}), 500
+    for baby_id, _, turns in replies:
+        maybe_schedule_summary(user_id, baby_id, turns + 1)
+    return answered
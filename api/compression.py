@@ -0,0 +1,126 @@
+"""
+Response compression and HTTP cache headers.
+
+Routes opt in to compression with @compress and to an explicit caching
+policy with @cache_control. Everything else under /api gets a safe
+default (private, revalidate on every use) so authenticated JSON is
+never stored by shared caches.
+"""
+
+import gzip
+from flask import request, current_app
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Mimetypes that are already compressed (or pointless to compress)
+INCOMPRESSIBLE_PREFIXES = ('image/', 'video/', 'audio/')
+INCOMPRESSIBLE_TYPES = {'application/zip', 'application/gzip', 'application/x-brotli'}
+
+def compress(view):
+    """Mark a view's responses as eligible for compression"""
+    view._compress = True
+    return view
+
+def cache_control(**directives):
+    """Attach a Cache-Control policy to a view, e.g. @cache_control(public=True, max_age=3600)"""
+    def decorator(view):
+        view._cache_control = directives
+        return view
+    return decorator
+
+def _view_attr(name, default=None):
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, name, default)
+
+def available_encodings():
+    """Encodings this process can produce, best first"""
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+def negotiate_encoding(accept_encodings):
+    """Pick the best encoding the client accepts, or None"""
+    best, best_quality = None, 0
+    for encoding in available_encodings():
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress_body(data, encoding, level=6, br_quality=4):
+    """Compress raw bytes with the given content-coding"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=br_quality)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def _is_compressible(response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    # Streams and files served via send_from_directory are passed through untouched
+    if response.direct_passthrough or response.is_streamed:
+        return False
+    if 'Content-Encoding' in response.headers:
+        return False
+    mimetype = response.mimetype or ''
+    if mimetype.startswith(INCOMPRESSIBLE_PREFIXES) or mimetype in INCOMPRESSIBLE_TYPES:
+        return False
+    return True
+
+def _apply_cache_control(response):
+    directives = _view_attr('_cache_control')
+
+    if directives is not None:
+        response.headers.pop('Cache-Control', None)
+        for key, value in directives.items():
+            setattr(response.cache_control, key, value)
+    elif not response.headers.get('Cache-Control'):
+        # Default for API responses: per-user data that must be revalidated
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+
+    if 'Authorization' in request.headers and not response.cache_control.public:
+        response.vary.add('Authorization')
+
+def _apply_compression(response):
+    if not _view_attr('_compress', False) or not _is_compressible(response):
+        return
+
+    # The representation depends on Accept-Encoding even when we send it uncompressed
+    response.vary.add('Accept-Encoding')
+
+    encoding = negotiate_encoding(request.accept_encodings)
+    if not encoding:
+        return
+
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return
+
+    compressed = compress_body(
+        data,
+        encoding,
+        level=current_app.config['COMPRESS_LEVEL'],
+        br_quality=current_app.config['COMPRESS_BR_QUALITY']
+    )
+    if len(compressed) >= len(data):
+        return
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+
+    # A strong validator must not be shared between encodings; a weak one still
+    # matches If-None-Match, so conditional requests keep working when compressed
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+def init_compression(app):
+    """Register the compression and caching middleware on the app"""
+    @app.after_request
+    def compress_and_cache(response):
+        if not request.path.startswith('/api/'):
+            return response
+        _apply_cache_control(response)
+        _apply_compression(response)
+        return response
@@ -1,14 +1,66 @@
+import json
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+# Load .env from the project root when there is one (local development). Deployments
+# set real environment variables, so cold starts skip python-dotenv entirely.
+_ENV_FILE = os.path.join(os.path.dirname(__file__), '..', '.env')
+if os.path.exists(_ENV_FILE):
+    from dotenv import load_dotenv
+    load_dotenv(_ENV_FILE)
 
 class Config:
     SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'dev-secret-key')
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'dev-secret-key')
-    JWT_ACCESS_TOKEN_EXPIRES = 3600  # 1 hour
+    JWT_ACCESS_TOKEN_EXPIRES = 900  # 15 minutes
+    JWT_REFRESH_TOKEN_EXPIRES = 30 * 24 * 3600  # 30 days
+    TOKEN_VERSION_REFRESH_SECONDS = int(os.getenv('TOKEN_VERSION_REFRESH_SECONDS', 5))  # how stale a revocation may be in other workers
     DATABASE_URL = os.getenv('DATABASE_URL')
+    DATABASE_REPLICA_URLS = [url for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url]  # read-only endpoints
+    REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))  # read from the primary this long after a write
+    REPLICA_RETRY_SECONDS = 30  # skip an unreachable replica this long
+    DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))  # connections opened by the startup pre-warm
+    # Per process and database; 0 disables pooling. Below the gunicorn thread count, requests queue for a connection
+    DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', int(os.getenv('GUNICORN_THREADS', 16)) + int(os.getenv('BACKGROUND_WORKERS', 2))))
+    DB_POOL_TIMEOUT = 10  # seconds to wait for a free pooled connection
+    PREWARM = os.getenv('PREWARM', 'true').lower() == 'true'  # warm database and LLM clients in the background at startup
     ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
     ADMIN_EMAIL = os.getenv('ADMIN_EMAIL', 'admin@example.com')
     MAX_CONTENT_LENGTH = 1 * 1024 * 1024  # 1MB max file size
     UPLOAD_FOLDER = 'uploads'
+    ADMIN_BATCH_LIMIT = 10000  # rows per bulk admin request
+    CHAT_MESSAGE_LIMIT = int(os.getenv('CHAT_MESSAGE_LIMIT', 20))  # messages per user/baby (10 back-and-forths), 0 = unlimited
+    CHAT_MODEL = os.getenv('CHAT_MODEL', 'claude-3-5-sonnet-20241022')
+    CHAT_MAX_TOKENS = int(os.getenv('CHAT_MAX_TOKENS', 1024))
+    # Per baby/stage model settings, e.g. {"baby:3": {"model": "claude-3-5-haiku-20241022"}, "stage:0": {"max_tokens": 256}}
+    # Most specific wins: "baby:<id>:stage:<index>", then "baby:<id>", then "stage:<index>"
+    CHAT_MODEL_OVERRIDES = json.loads(os.getenv('CHAT_MODEL_OVERRIDES', '{}'))
+    CHAT_MULTI_MAX_BABIES = int(os.getenv('CHAT_MULTI_MAX_BABIES', 5))  # babies per POST /chat/multi request
+    CHAT_MULTI_CONCURRENCY = int(os.getenv('CHAT_MULTI_CONCURRENCY', 4))  # model calls in flight per /chat/multi request
+    CHAT_GREETINGS = os.getenv('CHAT_GREETINGS', 'true').lower() == 'true'  # pre-generate opening greetings in the background
+    CHAT_LONG_MODE = os.getenv('CHAT_LONG_MODE', 'false').lower() == 'true'  # summarize old turns instead of resending them
+    CHAT_SUMMARY_TRIGGER_TURNS = int(os.getenv('CHAT_SUMMARY_TRIGGER_TURNS', 10))  # unsummarized turns before a summary refresh
+    CHAT_RECENT_TURNS = int(os.getenv('CHAT_RECENT_TURNS', 4))  # turns always sent verbatim
+    CHAT_SUMMARY_MODEL = os.getenv('CHAT_SUMMARY_MODEL', 'claude-3-5-haiku-20241022')
+    CHAT_RETENTION_DAYS = int(os.getenv('CHAT_RETENTION_DAYS', 180))  # months older than this move from chat_messages to ARCHIVE_FOLDER
+    CHAT_PARTITIONS_AHEAD = 3  # monthly chat_messages partitions created ahead of time
+    ARCHIVE_FOLDER = os.getenv('ARCHIVE_FOLDER', 'archive')  # gzipped NDJSON chat transcripts
+    TOKEN_QUOTAS = {  # monthly input + output tokens per role, 0 = unlimited; users.token_quota overrides per user
+        'user': int(os.getenv('TOKEN_QUOTA_USER', 0)),
+        'admin': int(os.getenv('TOKEN_QUOTA_ADMIN', 0)),
+    }
+    USAGE_FLUSH_SECONDS = 10  # write buffered token usage at least this often
+    USAGE_FLUSH_CALLS = 50  # or once this many calls are buffered
+    BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', 2))  # threads for summaries and other off-request work
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))  # bytes
+    COMPRESS_LEVEL = 6  # gzip level
+    COMPRESS_BR_QUALITY = 4  # brotli quality, used when the brotli package is installed
+    RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'true').lower() == 'true'
+    RATELIMIT_STORAGE = os.getenv('RATELIMIT_STORAGE', 'memory')  # 'memory' or 'postgres' (shared across workers)
+    CHANGE_LOG_RETENTION_HOURS = int(os.getenv('CHANGE_LOG_RETENTION_HOURS', 7 * 24))  # admin change feed history kept for resuming
+    CHANGE_HEARTBEAT_SECONDS = 15  # keepalive interval on idle change streams
+    CHANGE_STREAM_MAX_SECONDS = 300  # change streams end after this and the client reconnects with its cursor
+    IDEMPOTENCY_STORAGE = os.getenv('IDEMPOTENCY_STORAGE', 'memory')  # 'memory' or 'postgres' (shared across workers)
+    IDEMPOTENCY_TTL_SECONDS = 24 * 3600  # how long a stored response is replayed
+    IDEMPOTENCY_WAIT_SECONDS = 30  # how long a duplicate waits for the first request in flight
+    IDEMPOTENCY_LOCK_SECONDS = 120  # in-flight keys older than this are treated as abandoned (postgres storage)
+    TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', 1))  # proxies in front of the app that set X-Forwarded-For (Railway/Vercel: 1; 0 if clients connect directly)
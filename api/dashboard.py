@@ -0,0 +1,110 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from .database import get_db
+from .compression import compress
+from .babies import MY_BABIES_QUERY
+
+dashboard_bp = Blueprint('dashboard', __name__)
+
+BOOTSTRAP_FIELDS = ('me', 'settings', 'questionnaire', 'babies', 'selected_baby', 'my_babies')
+
+def _baby(b, **extra):
+    return {
+        'id': b['id'],
+        'name': b['name'],
+        'age': b['age'],
+        'attributes': b['attributes'],
+        'image_path': b['image_path'],
+        'life_stages': b.get('life_stages') or [],
+        **extra
+    }
+
+@dashboard_bp.route('/bootstrap', methods=['GET'])
+@jwt_required()
+@compress
+def bootstrap():
+    """Everything a page load needs in one response: the payloads of /auth/me, /settings,
+    /questionnaire, /babies, /babies/selected and /babies/my-babies, keyed by field name.
+
+    ?fields=me,babies limits the response to the named fields. The response carries an
+    ETag over the combined payload, so unchanged dashboards revalidate with a 304.
+    """
+    email = get_jwt_identity()
+
+    fields = request.args.get('fields')
+    fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(BOOTSTRAP_FIELDS)
+    unknown = [f for f in fields if f not in BOOTSTRAP_FIELDS]
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+
+    payload = {}
+
+    with get_db(readonly=True) as conn:
+        cursor = conn.cursor()
+
+        # User, questionnaire, selected baby and settings in one statement
+        cursor.execute('''
+            SELECT u.id, u.email, u.role, u.selected_baby_id, u.partner,
+                   q.answers, q.image_paths,
+                   sb.id AS sb_id, sb.name AS sb_name, sb.age AS sb_age, sb.attributes AS sb_attributes,
+                   sb.image_path AS sb_image_path, sb.life_stages AS sb_life_stages,
+                   (SELECT json_object_agg(key, value) FROM settings) AS settings
+            FROM users u
+            LEFT JOIN questionnaires q ON q.user_id = u.id
+            LEFT JOIN babies sb ON sb.id = u.selected_baby_id
+            WHERE u.email = %s
+        ''', (email,))
+        user = cursor.fetchone()
+
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+
+        if 'me' in fields:
+            payload['me'] = {
+                'id': user['id'],
+                'email': user['email'],
+                'role': user['role'],
+                'selected_baby_id': user['selected_baby_id'],
+                'partner': user['partner']
+            }
+
+        if 'settings' in fields:
+            payload['settings'] = user['settings'] or {}
+
+        if 'questionnaire' in fields:
+            payload['questionnaire'] = {
+                'answers': user['answers'] or {},
+                'image_paths': user['image_paths'] or []
+            }
+
+        if 'selected_baby' in fields:
+            payload['selected_baby'] = None
+            if user['sb_id']:
+                payload['selected_baby'] = _baby({
+                    'id': user['sb_id'],
+                    'name': user['sb_name'],
+                    'age': user['sb_age'],
+                    'attributes': user['sb_attributes'],
+                    'image_path': user['sb_image_path'],
+                    'life_stages': user['sb_life_stages']
+                })
+
+        if 'babies' in fields:
+            # Same visibility rules as GET /babies: admins see all, users see their assigned babies
+            if user['role'] == 'admin':
+                cursor.execute('SELECT id, name, age, attributes, image_path, is_visible, life_stages, user_id FROM babies ORDER BY id')
+            else:
+                cursor.execute('SELECT id, name, age, attributes, image_path, life_stages, user_id FROM babies WHERE user_id = %s AND is_visible = TRUE ORDER BY id', (user['id'],))
+
+            payload['babies'] = [
+                _baby(b, is_visible=b.get('is_visible', True), user_id=b.get('user_id'))
+                for b in cursor.fetchall()
+            ]
+
+        if 'my_babies' in fields:
+            cursor.execute(MY_BABIES_QUERY, (user['id'],))
+            payload['my_babies'] = [_baby(b) for b in cursor.fetchall()]
+
+    response = jsonify(payload)
+    response.add_etag()
+    return response.make_conditional(request)
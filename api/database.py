@@ -1,24 +1,325 @@
+import itertools
+import threading
+import time
+from datetime import date
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from flask import g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
 from .config import Config
 from contextlib import contextmanager
 
-def get_db_connection():
+# Cookie telling any worker that this client wrote recently and should read from the primary
+STICKY_COOKIE = 'db_primary_until'
+
+_recent_writers = {}  # identity -> monotonic time until which reads go to the primary
+_replica_down_until = {}  # replica url -> monotonic time until which it is skipped
+_replica_cycle = itertools.cycle(Config.DATABASE_REPLICA_URLS) if Config.DATABASE_REPLICA_URLS else None
+_replica_lock = threading.Lock()
+
+def get_db_connection(dsn=None):
     """Create a database connection"""
-    return psycopg2.connect(Config.DATABASE_URL, cursor_factory=RealDictCursor)
+    return psycopg2.connect(dsn or Config.DATABASE_URL, cursor_factory=RealDictCursor)
+
+class ConnectionPool:
+    """Thread-safe pool of connections to one database
+
+    Unlike psycopg2.pool, getconn() waits for a free slot instead of raising
+    when all DB_POOL_MAX connections are in use.
+    """
+
+    def __init__(self, dsn, maxconn):
+        self.dsn = dsn
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=Config.DB_POOL_TIMEOUT):
+            raise psycopg2.OperationalError('Timed out waiting for a database connection')
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return get_db_connection(self.dsn)
+                if not conn.closed:
+                    return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, discard=False):
+        try:
+            if discard or conn.closed:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _pool(dsn):
+    pool = _pools.get(dsn)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(dsn, ConnectionPool(dsn, Config.DB_POOL_MAX))
+    return pool
+
+def _acquire(dsn):
+    if not Config.DB_POOL_MAX:
+        return get_db_connection(dsn)
+    return _pool(dsn).getconn()
+
+def _release(dsn, conn, discard=False):
+    if not Config.DB_POOL_MAX:
+        conn.close()
+    else:
+        _pool(dsn).putconn(conn, discard)
+
+def prewarm_pool():
+    """Open DB_POOL_MIN primary connections ahead of the first request"""
+    conns = []
+    try:
+        for _ in range(min(Config.DB_POOL_MIN, Config.DB_POOL_MAX)):
+            conn = _acquire(Config.DATABASE_URL)
+            conns.append(conn)
+            conn.cursor().execute('SELECT 1')
+            conn.rollback()
+    finally:
+        for conn in conns:
+            _release(Config.DATABASE_URL, conn)
+
+def _current_identity():
+    if not has_request_context():
+        return None
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        # No JWT verified for this request
+        return None
+
+def _must_read_primary():
+    """Read-your-writes: clients that wrote recently read from the primary"""
+    if not has_request_context():
+        return False
+
+    until = request.cookies.get(STICKY_COOKIE)
+    if until and until.isdigit() and int(until) > time.time():
+        return True
+
+    identity = _current_identity()
+    return identity is not None and _recent_writers.get(identity, 0) > time.monotonic()
+
+def _mark_write():
+    if not has_request_context():
+        return
+    g.db_wrote = True
+    identity = _current_identity()
+    if identity is not None:
+        now = time.monotonic()
+        if len(_recent_writers) > 10000:
+            for key in [k for k, until in _recent_writers.items() if until <= now]:
+                _recent_writers.pop(key, None)
+        _recent_writers[identity] = now + Config.REPLICA_STICKY_SECONDS
+
+def _replica_connection():
+    """Connect to the next healthy replica; returns (conn, url) or (None, None) to use the primary"""
+    for _ in range(len(Config.DATABASE_REPLICA_URLS)):
+        with _replica_lock:
+            url = next(_replica_cycle)
+        if _replica_down_until.get(url, 0) > time.monotonic():
+            continue
+        try:
+            return _acquire(url), url
+        except psycopg2.OperationalError:
+            _replica_down_until[url] = time.monotonic() + Config.REPLICA_RETRY_SECONDS
+    return None, None
+
+def _wrote(conn):
+    """Whether the open transaction changed anything (Postgres assigns a transaction id on the first write)"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT pg_current_xact_id_if_assigned() IS NOT NULL AS wrote')
+    return cursor.fetchone()['wrote']
 
 @contextmanager
-def get_db():
-    """Context manager for database connections"""
-    conn = get_db_connection()
+def get_db(readonly=False, sticky=True):
+    """Context manager for database connections
+
+    readonly=True routes to a replica from DATABASE_REPLICA_URLS when one is
+    configured and reachable, unless the current user wrote within
+    REPLICA_STICKY_SECONDS; otherwise it falls back to the primary.
+
+    With replicas configured, a block that actually writes starts that
+    stickiness for the current user. sticky=False skips it for bookkeeping
+    writes the user never reads back (usage counters, idempotency keys).
+    """
+    conn = dsn = None
+    if readonly and _replica_cycle and not _must_read_primary():
+        conn, dsn = _replica_connection()
+    if conn is None:
+        dsn = Config.DATABASE_URL
+        conn = _acquire(dsn)
+
+    broken = wrote = False
     try:
+        # Pooled connections keep session settings, so set the mode every time
+        conn.set_session(readonly=readonly)
         yield conn
+        if not readonly and sticky and _replica_cycle and has_request_context():
+            wrote = _wrote(conn)
         conn.commit()
     except Exception as e:
-        conn.rollback()
+        broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
         raise e
     finally:
-        conn.close()
+        _release(dsn, conn, discard=broken)
+
+    if wrote:
+        _mark_write()
+
+def init_replica_routing(app):
+    """Carry read-your-writes stickiness to other workers through a short-lived cookie"""
+    @app.after_request
+    def set_sticky_cookie(response):
+        if g.get('db_wrote') and Config.DATABASE_REPLICA_URLS:
+            until = int(time.time() + Config.REPLICA_STICKY_SECONDS)
+            response.set_cookie(
+                STICKY_COOKIE, str(until),
+                max_age=Config.REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
+
+def _month_start(day):
+    return day.replace(day=1)
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1, day=1)
+
+def chat_partition_name(month):
+    return f'chat_messages_y{month.year}m{month.month:02d}'
+
+def create_chat_partition(cursor, month):
+    """Create the chat_messages partition for the month containing `month` unless it exists"""
+    month = _month_start(month)
+    name, bounds = chat_partition_name(month), (month, add_months(month, 1))
+    cursor.execute('SELECT to_regclass(%s) AS existing', (name,))
+    if cursor.fetchone()['existing']:
+        return
+
+    # CREATE + ATTACH only takes SHARE UPDATE EXCLUSIVE on chat_messages, unlike CREATE TABLE ... PARTITION OF
+    cursor.execute(f'CREATE TABLE {name} (LIKE chat_messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(f'ALTER TABLE chat_messages ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', bounds)
+
+def ensure_chat_partitions(cursor):
+    """Create partitions for the current month and the next CHAT_PARTITIONS_AHEAD months"""
+    # Web processes, init_db and the retention job may all get here at once
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('chat_messages_partitions'))")
+    today = date.today()
+    for months in range(Config.CHAT_PARTITIONS_AHEAD + 1):
+        create_chat_partition(cursor, add_months(today, months))
+
+_partitions_month = None  # month this process last ensured partitions for
+_partitions_lock = threading.Lock()
+
+def ensure_current_chat_partitions():
+    """ensure_chat_partitions at most once per process and month
+
+    Runs at startup and before chat requests, so chat writes keep working
+    on deploys without the retention cron.
+    """
+    global _partitions_month
+    month = _month_start(date.today())
+    if _partitions_month == month:
+        return
+    with _partitions_lock:
+        if _partitions_month == month:
+            return
+        with get_db() as conn:
+            ensure_chat_partitions(conn.cursor())
+        _partitions_month = month
+
+def _drop_default_partition(cursor):
+    """Move rows out of chat_messages_default into monthly partitions and drop it
+
+    Earlier versions caught rows for months without a partition there, but
+    while a default partition exists Postgres refuses DETACH PARTITION
+    CONCURRENTLY, which the retention job relies on.
+    """
+    cursor.execute("SELECT to_regclass('chat_messages_default') AS existing")
+    if not cursor.fetchone()['existing']:
+        return
+
+    cursor.execute("SELECT DISTINCT date_trunc('month', created_at)::date AS month FROM chat_messages_default")
+    months = [row['month'] for row in cursor.fetchall()]
+    cursor.execute('ALTER TABLE chat_messages DETACH PARTITION chat_messages_default')
+    for month in months:
+        create_chat_partition(cursor, month)
+    cursor.execute('INSERT INTO chat_messages SELECT * FROM chat_messages_default')
+    cursor.execute('DROP TABLE chat_messages_default')
+
+def _create_chat_messages(cursor):
+    """Create chat_messages partitioned by created_at, migrating an unpartitioned table in place
+
+    Each month gets its own partition (and its own small indexes), so reads
+    and inserts only ever touch shallow indexes and the retention job in
+    api/retention.py can detach and drop whole months instead of deleting
+    rows. There is no default partition: inserts always use the current
+    month, and init_db and the daily retention job keep
+    CHAT_PARTITIONS_AHEAD months of partitions ready.
+    """
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('chat_messages')")
+    existing = cursor.fetchone()
+    if existing and existing['relkind'] == 'p':
+        _drop_default_partition(cursor)
+        ensure_chat_partitions(cursor)
+        return
+
+    if existing:
+        # Keep ids (chat_summaries.summarized_through_id points at them) and the id sequence
+        cursor.execute('ALTER TABLE chat_messages RENAME TO chat_messages_unpartitioned')
+        id_column = "id INTEGER NOT NULL DEFAULT nextval('chat_messages_id_seq')"
+    else:
+        id_column = 'id SERIAL'
+
+    cursor.execute(f'''
+        CREATE TABLE chat_messages (
+            {id_column},
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            baby_id INTEGER REFERENCES babies(id) ON DELETE CASCADE,
+            message TEXT NOT NULL,
+            role VARCHAR(50) NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    ''')
+    cursor.execute('CREATE INDEX idx_chat_messages_conversation ON chat_messages (user_id, baby_id, id)')
+
+    ensure_chat_partitions(cursor)
+    if not existing:
+        return
+
+    cursor.execute('''
+        SELECT DISTINCT date_trunc('month', created_at)::date AS month
+        FROM chat_messages_unpartitioned WHERE created_at IS NOT NULL
+    ''')
+    for row in cursor.fetchall():
+        create_chat_partition(cursor, row['month'])
+    cursor.execute('''
+        INSERT INTO chat_messages (id, user_id, baby_id, message, role, created_at)
+        SELECT id, user_id, baby_id, message, role, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM chat_messages_unpartitioned
+    ''')
+    cursor.execute('ALTER SEQUENCE chat_messages_id_seq OWNED BY chat_messages.id')
+    cursor.execute('DROP TABLE chat_messages_unpartitioned')
 
 def init_db():
     """Initialize database tables"""
@@ -63,29 +364,60 @@ def init_db():
             )
         ''')
 
-        # Chat messages table
+        # Chat messages table, range-partitioned by month (see _create_chat_messages)
+        _create_chat_messages(cursor)
+
+        # Chat sessions tracking
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_messages (
+            CREATE TABLE IF NOT EXISTS chat_sessions (
                 id SERIAL PRIMARY KEY,
                 user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
                 baby_id INTEGER REFERENCES babies(id) ON DELETE CASCADE,
-                message TEXT NOT NULL,
-                role VARCHAR(50) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                message_count INTEGER DEFAULT 0,
+                UNIQUE(user_id, baby_id)
             )
         ''')
 
-        # Chat sessions tracking
+        # Babies each user has interacted with (chatted with or selected), backing /babies/my-babies
         cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_sessions (
+            CREATE TABLE IF NOT EXISTS user_babies (
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                baby_id INTEGER REFERENCES babies(id) ON DELETE CASCADE,
+                has_chat BOOLEAN NOT NULL DEFAULT FALSE,
+                is_selected BOOLEAN NOT NULL DEFAULT FALSE,
+                PRIMARY KEY (user_id, baby_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_user_babies_active
+            ON user_babies (user_id, baby_id) WHERE has_chat OR is_selected
+        ''')
+
+        # Rolling summaries of long conversations (CHAT_LONG_MODE)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_summaries (
                 id SERIAL PRIMARY KEY,
                 user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
                 baby_id INTEGER REFERENCES babies(id) ON DELETE CASCADE,
-                message_count INTEGER DEFAULT 0,
+                summary TEXT NOT NULL,
+                summarized_through_id INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 UNIQUE(user_id, baby_id)
             )
         ''')
 
+        # Pre-generated opening greetings per baby, life stage (-1 = default persona) and persona version
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS baby_greetings (
+                baby_id INTEGER REFERENCES babies(id) ON DELETE CASCADE,
+                stage_index INTEGER NOT NULL,
+                prompt_version INTEGER NOT NULL,
+                greeting TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (baby_id, stage_index, prompt_version)
+            )
+        ''')
+
         # Settings table for global app settings
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS settings (
@@ -141,5 +473,199 @@ def init_db():
             END $$;
         ''')
 
+        # users.selected_baby_id references babies (cleared when the baby is deleted), so selecting a
+        # missing baby fails in the UPDATE itself; selections of already-deleted babies are cleared first
+        cursor.execute('''
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM pg_constraint WHERE conname = 'users_selected_baby_id_fkey'
+                ) THEN
+                    UPDATE users SET selected_baby_id = NULL
+                    WHERE selected_baby_id IS NOT NULL
+                    AND NOT EXISTS (SELECT 1 FROM babies b WHERE b.id = users.selected_baby_id);
+                    ALTER TABLE users ADD CONSTRAINT users_selected_baby_id_fkey
+                    FOREIGN KEY (selected_baby_id) REFERENCES babies(id) ON DELETE SET NULL;
+                END IF;
+            END $$;
+        ''')
+
+        # Add prompt_version column to existing babies table if it doesn't exist
+        cursor.execute('''
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'babies' AND column_name = 'prompt_version'
+                ) THEN
+                    ALTER TABLE babies ADD COLUMN prompt_version INTEGER NOT NULL DEFAULT 1;
+                END IF;
+            END $$;
+        ''')
+
+        # Add token revocation columns to existing users table if they don't exist
+        cursor.execute('''
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'users' AND column_name = 'token_version'
+                ) THEN
+                    ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0;
+                    ALTER TABLE users ADD COLUMN token_revoked_at TIMESTAMP;
+                END IF;
+            END $$;
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_token_revoked_at
+            ON users (token_revoked_at) WHERE token_revoked_at IS NOT NULL
+        ''')
+
+        # Backfill user_babies from chat sessions and selections made before it existed
+        cursor.execute('''
+            INSERT INTO user_babies (user_id, baby_id, has_chat)
+            SELECT user_id, baby_id, TRUE FROM chat_sessions
+            WHERE user_id IS NOT NULL AND baby_id IS NOT NULL
+            ON CONFLICT (user_id, baby_id) DO UPDATE SET has_chat = TRUE WHERE NOT user_babies.has_chat
+        ''')
+        cursor.execute('''
+            INSERT INTO user_babies (user_id, baby_id, is_selected)
+            SELECT u.id, u.selected_baby_id, TRUE
+            FROM users u JOIN babies b ON b.id = u.selected_baby_id
+            ON CONFLICT (user_id, baby_id) DO UPDATE SET is_selected = TRUE WHERE NOT user_babies.is_selected
+        ''')
+
+        # Indexes for admin search (api/search.py): keyset ordering, full-text, JSONB keys and attribute arrays
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at DESC, id DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_email_prefix ON users (lower(email) text_pattern_ops)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_questionnaires_updated_at ON questionnaires (updated_at DESC, id DESC)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_questionnaires_answers ON questionnaires USING GIN (answers)')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_questionnaires_answers_fts ON questionnaires USING GIN (to_tsvector('simple', answers))")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_fts ON chat_messages USING GIN (to_tsvector('simple', message))")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_babies_attributes ON babies USING GIN (attributes)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_babies_created_at ON babies (created_at DESC, id DESC)')
+
+        # Token buckets for rate limiting (RATELIMIT_STORAGE=postgres); losing them on crash is harmless
+        cursor.execute('''
+            CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+                key VARCHAR(255) PRIMARY KEY,
+                tokens DOUBLE PRECISION NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL
+            )
+        ''')
+        # Consume from several buckets in one round trip, in order, stopping at the first empty one.
+        # Returns the tokens left per bucket checked; NULL marks the empty one.
+        cursor.execute('''
+            CREATE OR REPLACE FUNCTION consume_rate_limits(
+                keys TEXT[], capacities DOUBLE PRECISION[], rates DOUBLE PRECISION[], costs DOUBLE PRECISION[]
+            ) RETURNS DOUBLE PRECISION[] AS $$
+            DECLARE
+                result DOUBLE PRECISION[] := '{}';
+                remaining DOUBLE PRECISION;
+            BEGIN
+                FOR i IN 1 .. coalesce(array_length(keys, 1), 0) LOOP
+                    INSERT INTO rate_limit_buckets AS b (key, tokens, updated_at)
+                    VALUES (keys[i], capacities[i] - costs[i], clock_timestamp())
+                    ON CONFLICT (key) DO UPDATE
+                    SET tokens = LEAST(capacities[i], b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * rates[i]) - costs[i],
+                        updated_at = clock_timestamp()
+                    WHERE LEAST(capacities[i], b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * rates[i]) >= costs[i]
+                    RETURNING b.tokens INTO remaining;
+
+                    result := array_append(result, remaining);
+                    EXIT WHEN remaining IS NULL;
+                END LOOP;
+                RETURN result;
+            END;
+            $$ LANGUAGE plpgsql
+        ''')
+
+        # LLM token usage per day, user (0 = no user), baby (0 = none), model and purpose (api/usage.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS llm_usage (
+                day DATE NOT NULL,
+                user_id INTEGER NOT NULL,
+                baby_id INTEGER NOT NULL,
+                model VARCHAR(100) NOT NULL,
+                purpose VARCHAR(50) NOT NULL,
+                calls BIGINT NOT NULL DEFAULT 0,
+                input_tokens BIGINT NOT NULL DEFAULT 0,
+                output_tokens BIGINT NOT NULL DEFAULT 0,
+                cache_read_tokens BIGINT NOT NULL DEFAULT 0,
+                cache_creation_tokens BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, user_id, baby_id, model, purpose)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_usage_user_day ON llm_usage (user_id, day)')
+
+        # Add token_quota column to existing users table if it doesn't exist (NULL = role default)
+        cursor.execute('''
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'users' AND column_name = 'token_quota'
+                ) THEN
+                    ALTER TABLE users ADD COLUMN token_quota BIGINT;
+                END IF;
+            END $$;
+        ''')
+
+        # Row-level change feed for admin dashboards (api/changes.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_log (
+                id BIGSERIAL PRIMARY KEY,
+                txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+                table_name VARCHAR(64) NOT NULL,
+                op VARCHAR(10) NOT NULL,
+                row_id INTEGER,
+                data JSONB,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_log_position ON change_log (txid, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_log_created_at ON change_log (created_at)')
+        cursor.execute('''
+            CREATE OR REPLACE FUNCTION log_change() RETURNS trigger AS $$
+            DECLARE
+                row_data JSONB;
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    row_data := to_jsonb(OLD) - 'password_hash';
+                ELSE
+                    row_data := to_jsonb(NEW) - 'password_hash';
+                END IF;
+                INSERT INTO change_log (table_name, op, row_id, data)
+                VALUES (TG_TABLE_NAME, TG_OP, (row_data->>'id')::integer,
+                        CASE WHEN TG_OP = 'DELETE' THEN NULL ELSE row_data END);
+                -- Identical payloads are delivered once per transaction
+                PERFORM pg_notify('changes', TG_TABLE_NAME);
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        ''')
+        for table in ('users', 'questionnaires', 'babies', 'chat_sessions'):
+            cursor.execute(f'''
+                DROP TRIGGER IF EXISTS {table}_log_change ON {table};
+                CREATE TRIGGER {table}_log_change AFTER INSERT OR DELETE ON {table}
+                FOR EACH ROW EXECUTE FUNCTION log_change();
+                DROP TRIGGER IF EXISTS {table}_log_update ON {table};
+                CREATE TRIGGER {table}_log_update AFTER UPDATE ON {table}
+                FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION log_change();
+            ''')
+
+        # Stored responses for Idempotency-Key replays (IDEMPOTENCY_STORAGE=postgres)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key VARCHAR(512) PRIMARY KEY,
+                fingerprint VARCHAR(64) NOT NULL,
+                status_code INTEGER,
+                body BYTEA,
+                content_type VARCHAR(255),
+                expires_at TIMESTAMPTZ NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at)')
+
         conn.commit()
         print("Database tables created successfully!")
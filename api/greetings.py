@@ -0,0 +1,123 @@
+"""
+Pre-generated opening greetings.
+
+When a baby becomes visible, is assigned or is selected, a background job
+asks the model for an opening message for the default persona and each
+life stage and stores it in baby_greetings, keyed by babies.prompt_version.
+An empty chat then shows the greeting straight from the table, and the
+first message of the conversation saves it as the opening assistant turn.
+
+Editing a baby bumps prompt_version, so greetings for the old persona are
+never served again; the next generation run deletes them.
+"""
+
+from .config import Config
+from .database import get_db
+from .llm import get_client, chat_model, response_text
+from .personas import personas, PERSONA_COLUMNS
+from .tasks import submit_once
+from .usage import usage
+
+# The user turn a greeting answers; also sent ahead of it once the conversation starts
+GREETING_REQUEST = '(The user has just opened a chat with you. Greet them in one or two short sentences.)'
+
+# baby_greetings.stage_index for the default persona (stage_index None elsewhere)
+DEFAULT_STAGE = -1
+
+def _stage_key(stage_index):
+    return DEFAULT_STAGE if stage_index is None else stage_index
+
+def load_greeting(cursor, baby_id, stage_index=None):
+    """The stored greeting for the baby's current persona, or None"""
+    cursor.execute(
+        '''
+        SELECT g.greeting
+        FROM baby_greetings g
+        JOIN babies b ON b.id = g.baby_id AND b.prompt_version = g.prompt_version
+        WHERE g.baby_id = %s AND g.stage_index = %s
+        ''',
+        (baby_id, _stage_key(stage_index))
+    )
+    row = cursor.fetchone()
+    return row['greeting'] if row else None
+
+def load_greetings(cursor, baby_ids, stage_index=None):
+    """{baby_id: stored greeting} for several babies in one query; babies without one are left out"""
+    cursor.execute(
+        '''
+        SELECT g.baby_id, g.greeting
+        FROM baby_greetings g
+        JOIN babies b ON b.id = g.baby_id AND b.prompt_version = g.prompt_version
+        WHERE g.baby_id = ANY(%s) AND g.stage_index = %s
+        ''',
+        (list(baby_ids), _stage_key(stage_index))
+    )
+    return {row['baby_id']: row['greeting'] for row in cursor.fetchall()}
+
+def save_opening_greeting(cursor, user_id, baby_id, stage_index=None):
+    """Start a new conversation with the stored greeting, if there is one"""
+    cursor.execute(
+        '''
+        INSERT INTO chat_messages (user_id, baby_id, message, role)
+        SELECT %s, g.baby_id, g.greeting, 'assistant'
+        FROM baby_greetings g
+        JOIN babies b ON b.id = g.baby_id AND b.prompt_version = g.prompt_version
+        WHERE g.baby_id = %s AND g.stage_index = %s
+        ''',
+        (user_id, baby_id, _stage_key(stage_index))
+    )
+
+def schedule_greetings(baby_ids):
+    """Queue greeting generation for each baby (deduplicated per baby)"""
+    if not Config.CHAT_GREETINGS:
+        return
+    for baby_id in baby_ids:
+        submit_once(('greetings', baby_id), generate_greetings, baby_id)
+
+def generate_greetings(baby_id, client=None):
+    """Generate missing greetings for the baby's current persona; returns how many were created"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT {PERSONA_COLUMNS} FROM babies WHERE id = %s', (baby_id,))
+        baby = cursor.fetchone()
+        if not baby:
+            return 0
+        cursor.execute(
+            'SELECT stage_index FROM baby_greetings WHERE baby_id = %s AND prompt_version = %s',
+            (baby_id, baby['prompt_version'])
+        )
+        existing = {row['stage_index'] for row in cursor.fetchall()}
+
+    stages = [None] + list(range(len(baby['life_stages'] or [])))
+    missing = [stage_index for stage_index in stages if _stage_key(stage_index) not in existing]
+
+    # Model calls happen outside any transaction
+    greetings = []
+    for stage_index in missing:
+        model, max_tokens = chat_model(baby_id, stage_index)
+        response = (client or get_client()).messages.create(
+            model=model,
+            max_tokens=min(max_tokens, 256),
+            system=personas.get(baby, stage_index),
+            messages=[{'role': 'user', 'content': GREETING_REQUEST}]
+        )
+        usage.record(None, baby_id, model, 'greeting', response)
+        greetings.append((baby_id, _stage_key(stage_index), baby['prompt_version'], response_text(response)))
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        for greeting in greetings:
+            cursor.execute(
+                '''
+                INSERT INTO baby_greetings (baby_id, stage_index, prompt_version, greeting)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (baby_id, stage_index, prompt_version) DO NOTHING
+                ''',
+                greeting
+            )
+        cursor.execute(
+            'DELETE FROM baby_greetings WHERE baby_id = %s AND prompt_version < %s',
+            (baby_id, baby['prompt_version'])
+        )
+
+    return len(greetings)
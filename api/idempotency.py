@@ -0,0 +1,300 @@
+"""
+Idempotency-Key support for write endpoints.
+
+A client that retries a request with the same Idempotency-Key header gets
+the stored response of the first attempt instead of running the view
+again (no second Claude call, no duplicate rows, no extra message quota).
+A duplicate that arrives while the first attempt is still running waits up
+to IDEMPOTENCY_WAIT_SECONDS for it to finish. Reusing a key with a
+different request body is rejected with 422.
+
+Keys are scoped to the endpoint and the JWT identity, and expire after
+IDEMPOTENCY_TTL_SECONDS. Server errors, 429s and streamed responses are
+not stored, so those can be retried with the same key.
+
+Nothing secret is stored: request bodies (which may hold a password) are
+kept only as an HMAC keyed with SECRET_KEY, and an endpoint can name
+response fields (tokens) to drop before storing and re-issue on replay.
+
+Records live in process memory by default. Set IDEMPOTENCY_STORAGE=postgres
+to keep them in the idempotency_keys table instead, so retries that reach
+another gunicorn worker or instance are recognised too.
+
+Usage (below @jwt_required so the user scope is available, above
+@rate_limit so replays are not counted against the limit):
+
+    @chat_bp.route('/chat/<int:baby_id>', methods=['POST'])
+    @jwt_required()
+    @idempotent('chat')
+    @rate_limit('chat', 10, 60, key='user')
+    def send_message(baby_id): ...
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from functools import wraps
+import psycopg2
+from flask import request, jsonify, make_response
+from flask_jwt_extended import get_jwt_identity
+from .config import Config
+from .database import get_db
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+StoredResponse = namedtuple('StoredResponse', ['status', 'body', 'content_type'])
+
+# Outcomes of IdempotencyStore.begin()
+STARTED, REPLAY, IN_FLIGHT, MISMATCH = 'started', 'replay', 'in_flight', 'mismatch'
+
+class MemoryIdempotencyStore:
+    """Per-process records: {key: [fingerprint, expires_at, StoredResponse or None, done Event]}"""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def begin(self, key, fingerprint):
+        """Claim `key` for a new request; returns (outcome, StoredResponse or None)"""
+        now = time.monotonic()
+        with self._lock:
+            self._calls += 1
+            if self._calls % self.PRUNE_EVERY == 0:
+                self._prune(now)
+
+            record = self._records.get(key)
+            if record is None or (record[2] is not None and record[1] <= now):
+                self._records[key] = [fingerprint, now + Config.IDEMPOTENCY_TTL_SECONDS, None, threading.Event()]
+                return STARTED, None
+            if record[0] != fingerprint:
+                return MISMATCH, None
+            if record[2] is not None:
+                return REPLAY, record[2]
+            done = record[3]
+
+        # Concurrent duplicate: wait for the first request without holding the lock
+        done.wait(Config.IDEMPOTENCY_WAIT_SECONDS)
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None and record[2] is not None:
+                return REPLAY, record[2]
+        return IN_FLIGHT, None
+
+    def complete(self, key, response):
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None:
+                record[1] = time.monotonic() + Config.IDEMPOTENCY_TTL_SECONDS
+                record[2] = response
+                record[3].set()
+
+    def release(self, key):
+        """Forget an unfinished request so the key can be retried"""
+        with self._lock:
+            record = self._records.pop(key, None)
+        if record is not None:
+            record[3].set()
+
+    def _prune(self, now):
+        expired = [k for k, record in self._records.items() if record[2] is not None and record[1] <= now]
+        for key in expired:
+            del self._records[key]
+
+class PostgresIdempotencyStore:
+    """Records shared through the idempotency_keys table
+
+    An in-flight row (status_code NULL) expires after IDEMPOTENCY_LOCK_SECONDS,
+    so a worker that died mid-request does not block the key for the full TTL.
+    """
+
+    CLAIM_SQL = '''
+        INSERT INTO idempotency_keys AS k (key, fingerprint, expires_at)
+        VALUES (%(key)s, %(fingerprint)s, clock_timestamp() + make_interval(secs => %(lock)s))
+        ON CONFLICT (key) DO UPDATE
+        SET fingerprint = EXCLUDED.fingerprint, status_code = NULL, body = NULL, content_type = NULL,
+            expires_at = EXCLUDED.expires_at
+        WHERE k.expires_at <= clock_timestamp()
+        RETURNING key
+    '''
+
+    POLL_INTERVAL = 0.2
+    PRUNE_EVERY = 1000
+
+    def __init__(self):
+        self._calls = 0
+        # Used when the database is unreachable, so an outage does not take down chat
+        self._fallback = MemoryIdempotencyStore()
+
+    def begin(self, key, fingerprint):
+        self._calls += 1
+        deadline = time.monotonic() + Config.IDEMPOTENCY_WAIT_SECONDS
+        try:
+            while True:
+                with get_db(sticky=False) as conn:
+                    cursor = conn.cursor()
+                    if self._calls % self.PRUNE_EVERY == 0:
+                        cursor.execute('DELETE FROM idempotency_keys WHERE expires_at <= clock_timestamp()')
+                    cursor.execute(self.CLAIM_SQL, {
+                        'key': key, 'fingerprint': fingerprint, 'lock': Config.IDEMPOTENCY_LOCK_SECONDS
+                    })
+                    if cursor.fetchone():
+                        return STARTED, None
+
+                    cursor.execute(
+                        'SELECT fingerprint, status_code, body, content_type FROM idempotency_keys WHERE key = %s',
+                        (key,)
+                    )
+                    row = cursor.fetchone()
+
+                if row is not None:
+                    if row['fingerprint'] != fingerprint:
+                        return MISMATCH, None
+                    if row['status_code'] is not None:
+                        return REPLAY, StoredResponse(row['status_code'], bytes(row['body']), row['content_type'])
+                if time.monotonic() >= deadline:
+                    return IN_FLIGHT, None
+                time.sleep(self.POLL_INTERVAL)
+        except psycopg2.Error:
+            logger.exception('Idempotency store unavailable, using process memory')
+            return self._fallback.begin(key, fingerprint)
+
+    def complete(self, key, response):
+        try:
+            with get_db(sticky=False) as conn:
+                conn.cursor().execute(
+                    '''
+                    UPDATE idempotency_keys
+                    SET status_code = %s, body = %s, content_type = %s,
+                        expires_at = clock_timestamp() + make_interval(secs => %s)
+                    WHERE key = %s
+                    ''',
+                    (response.status, psycopg2.Binary(response.body), response.content_type,
+                     Config.IDEMPOTENCY_TTL_SECONDS, key)
+                )
+        except psycopg2.Error:
+            logger.exception('Failed to store idempotent response')
+        self._fallback.complete(key, response)
+
+    def release(self, key):
+        try:
+            with get_db(sticky=False) as conn:
+                conn.cursor().execute('DELETE FROM idempotency_keys WHERE key = %s AND status_code IS NULL', (key,))
+        except psycopg2.Error:
+            logger.exception('Failed to release idempotency key')
+        self._fallback.release(key)
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the process-wide idempotency store, created on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if Config.IDEMPOTENCY_STORAGE == 'postgres':
+                    _store = PostgresIdempotencyStore()
+                else:
+                    _store = MemoryIdempotencyStore()
+    return _store
+
+def _identity():
+    try:
+        return get_jwt_identity() or '-'
+    except RuntimeError:
+        # Endpoint without @jwt_required (registration)
+        return '-'
+
+def _fingerprint():
+    """Keyed hash of what makes two requests "the same": method, path, query string and body"""
+    # Keyed, so a stored fingerprint cannot be used to guess a password in the body
+    digest = hmac.new(Config.SECRET_KEY.encode(), digestmod=hashlib.sha256)
+    for part in (request.method, request.full_path):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    if request.mimetype == 'multipart/form-data':
+        # The boundary changes on every retry, so hash the parsed fields rather than the raw body
+        for name, value in sorted(request.form.items(multi=True)):
+            digest.update(f'{name}={value}'.encode())
+            digest.update(b'\0')
+        for name, upload in sorted(request.files.items(multi=True), key=lambda item: (item[0], item[1].filename or '')):
+            digest.update(f'{name}:{upload.filename}'.encode())
+            digest.update(upload.stream.read())
+            upload.stream.seek(0)
+    else:
+        digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+def _should_store(response):
+    return not response.is_streamed and response.status_code < 500 and response.status_code != 429
+
+def _without(body, fields):
+    """A JSON object body with `fields` removed; other bodies unchanged"""
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return body
+    if not isinstance(payload, dict):
+        return body
+    return json.dumps({k: v for k, v in payload.items() if k not in fields}).encode()
+
+def idempotent(scope, secret_fields=(), reissue=None):
+    """Decorator: replay the stored response for a repeated Idempotency-Key
+
+    secret_fields are dropped from a JSON response before it is stored. On
+    replay of a 2xx response, reissue(body) returns fresh values for them,
+    or None to replay without them.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'}), 400
+
+            store = get_store()
+            store_key = f'{scope}:{_identity()}:{key}'
+            outcome, stored = store.begin(store_key, _fingerprint())
+
+            if outcome == MISMATCH:
+                return jsonify({'error': f'{HEADER} was already used for a different request'}), 422
+            if outcome == IN_FLIGHT:
+                return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+            if outcome == REPLAY:
+                body = stored.body
+                if reissue is not None and 200 <= stored.status < 300:
+                    payload = json.loads(body)
+                    body = json.dumps({**payload, **(reissue(payload) or {})})
+                response = make_response(body, stored.status)
+                response.content_type = stored.content_type
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                store.release(store_key)
+                raise
+
+            if _should_store(response):
+                body = response.get_data()
+                if secret_fields:
+                    body = _without(body, secret_fields)
+                store.complete(store_key, StoredResponse(response.status_code, body, response.content_type))
+            else:
+                store.release(store_key)
+            return response
+        return wrapper
+    return decorator
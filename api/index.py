@@ -1,51 +1,111 @@
 from flask import Flask, send_from_directory
-from flask_cors import CORS
-from flask_jwt_extended import JWTManager
 from .config import Config
-from .database import init_db
-from .auth import auth_bp
-from .questionnaire import questionnaire_bp
-from .babies import babies_bp
-from .chat import chat_bp
-from .settings import settings_bp
+import logging
 import os
+import threading
 
-app = Flask(__name__)
-app.config.from_object(Config)
+logger = logging.getLogger(__name__)
 
-# Enable CORS
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+def prewarm():
+    """Open pooled database connections, create this month's chat partitions, build the LLM client and
+    load token revocations before the first request needs them"""
+    from .database import prewarm_pool, ensure_current_chat_partitions
+    from .llm import get_client
+    from .tokens import token_versions
 
-# Initialize JWT
-jwt = JWTManager(app)
+    for step in (prewarm_pool, ensure_current_chat_partitions, get_client, token_versions.refresh):
+        try:
+            step()
+        except Exception:
+            logger.exception('Pre-warm step %s failed', step.__name__)
 
-# Register blueprints
-app.register_blueprint(auth_bp, url_prefix='/api/auth')
-app.register_blueprint(questionnaire_bp, url_prefix='/api')
-app.register_blueprint(babies_bp, url_prefix='/api')
-app.register_blueprint(chat_bp, url_prefix='/api')
-app.register_blueprint(settings_bp, url_prefix='/api')
+def create_app(config=Config, start_prewarm=None):
+    """Build the Flask app
 
-# Serve uploaded files
-@app.route('/api/uploads/<path:filename>')
-def serve_upload(filename):
-    upload_dir = os.path.join(os.path.dirname(__file__), '..', Config.UPLOAD_FOLDER)
-    return send_from_directory(upload_dir, filename)
+    Heavy dependencies (anthropic) are imported lazily by the code that uses
+    them; with PREWARM enabled they are loaded in a background thread so the
+    first request does not pay for them.
+    """
+    from flask_cors import CORS
+    from flask_jwt_extended import JWTManager
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    from .database import init_db, init_replica_routing
+    from .compression import init_compression, cache_control
+    from .ratelimit import init_rate_limiting
+    from .tokens import init_tokens
+    from .auth import auth_bp
+    from .questionnaire import questionnaire_bp
+    from .babies import babies_bp
+    from .chat import chat_bp
+    from .settings import settings_bp
+    from .dashboard import dashboard_bp
+    from .search import search_bp
+    from .changes import changes_bp
+    from .usage import usage_bp
 
-@app.route("/api/health")
-def health():
-    return {"status": "ok"}
+    app = Flask(__name__)
+    app.config.from_object(config)
 
-@app.route("/api/init-db")
-def initialize_database():
-    try:
-        init_db()
-        return {"message": "Database initialized successfully"}
-    except Exception as e:
-        return {"error": str(e)}, 500
+    # Trust X-Forwarded-For from our own proxies so per-IP limits see the real client
+    if config.TRUSTED_PROXY_COUNT:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.TRUSTED_PROXY_COUNT)
+
+    # Enable CORS
+    CORS(app, resources={r"/api/*": {"origins": "*"}})
+
+    # Compression and Cache-Control/Vary headers for API responses
+    init_compression(app)
+
+    # RateLimit-* headers for rate limited routes
+    init_rate_limiting(app)
+
+    # Read-your-writes stickiness for replica routing
+    init_replica_routing(app)
+
+    # Initialize JWT
+    jwt = JWTManager(app)
+    init_tokens(jwt)
+
+    # Register blueprints
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(questionnaire_bp, url_prefix='/api')
+    app.register_blueprint(babies_bp, url_prefix='/api')
+    app.register_blueprint(chat_bp, url_prefix='/api')
+    app.register_blueprint(settings_bp, url_prefix='/api')
+    app.register_blueprint(dashboard_bp, url_prefix='/api')
+    app.register_blueprint(search_bp, url_prefix='/api/admin')
+    app.register_blueprint(changes_bp, url_prefix='/api/admin')
+    app.register_blueprint(usage_bp, url_prefix='/api/admin')
+
+    # Serve uploaded files
+    @app.route('/api/uploads/<path:filename>')
+    @cache_control(public=True, max_age=3600)
+    def serve_upload(filename):
+        upload_dir = os.path.join(os.path.dirname(__file__), '..', config.UPLOAD_FOLDER)
+        return send_from_directory(upload_dir, filename)
+
+    @app.route("/api/health")
+    @cache_control(no_store=True)
+    def health():
+        return {"status": "ok"}
+
+    @app.route("/api/init-db")
+    def initialize_database():
+        try:
+            init_db()
+            return {"message": "Database initialized successfully"}
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+    if config.PREWARM if start_prewarm is None else start_prewarm:
+        threading.Thread(target=prewarm, name='prewarm', daemon=True).start()
+
+    return app
+
+app = create_app()
 
 # Export for Vercel
 handler = app
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,47 @@
+"""
+Shared Anthropic client.
+
+All model calls go through get_client() so the HTTP connection pool is
+reused across requests and a fake model can be swapped in with
+set_client() (anything with a compatible messages.create()). The
+anthropic package is imported on first use; it is the slowest import in
+the app and most cold starts never call the model.
+"""
+
+import threading
+from .config import Config
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process-wide Anthropic client, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from anthropic import Anthropic
+                _client = Anthropic(api_key=Config.ANTHROPIC_API_KEY)
+    return _client
+
+def set_client(client):
+    """Replace the shared client (e.g. with a fake model)"""
+    global _client
+    with _client_lock:
+        _client = client
+
+def chat_model(baby_id, stage_index=None):
+    """(model, max_tokens) for a baby and stage, from CHAT_MODEL_OVERRIDES or the defaults"""
+    overrides = Config.CHAT_MODEL_OVERRIDES
+    settings = {'model': Config.CHAT_MODEL, 'max_tokens': Config.CHAT_MAX_TOKENS}
+    # Least to most specific; later entries win
+    keys = [f'baby:{baby_id}']
+    if stage_index is not None:
+        keys = [f'stage:{stage_index}', f'baby:{baby_id}', f'baby:{baby_id}:stage:{stage_index}']
+    for key in keys:
+        settings.update(overrides.get(key, {}))
+    return settings['model'], settings['max_tokens']
+
+def response_text(response):
+    """Text of the first content block of a messages.create() response"""
+    return response.content[0].text
@@ -0,0 +1,77 @@
+"""
+Persona registry: precompiled system prompts per baby and life stage.
+
+Prompts are built once per (baby_id, stage_index, prompt_version) and kept
+in a bounded in-process cache. babies.prompt_version is bumped whenever a
+baby's persona fields change, which makes every cached prompt for the old
+version unreachable. stage_index None is the baby's default persona.
+"""
+
+import threading
+from collections import OrderedDict
+
+# Columns a baby row needs for prompt compilation
+PERSONA_COLUMNS = 'id, name, age, attributes, life_stages, prompt_version'
+
+def render_prompt(baby_name, baby_age, baby_attributes, stage=None):
+    """Format the baby chat prompt"""
+    attributes_str = ", ".join(baby_attributes)
+
+    if stage:
+        # Use stage-specific age and description
+        return f"""You are {baby_name} at {stage['age']}. {stage['description']}
+
+Your core traits: {attributes_str}.
+
+Respond as {baby_name} at {stage['age']} would - with appropriate language, personality, and behavior for this age.
+Be genuine, stay in character, and keep responses concise and engaging."""
+    else:
+        # Default prompt
+        return f"""You are {baby_name}, a {baby_age} baby with the following traits: {attributes_str}.
+
+Respond as this baby would - with appropriate language, personality, and behavior for their age and attributes.
+Be playful, genuine, and stay in character. Keep responses concise and engaging."""
+
+class PersonaRegistry:
+    """LRU cache of compiled prompts keyed by (baby_id, stage_index, prompt_version)"""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._prompts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(self, baby):
+        """Build and cache the default prompt and one prompt per life stage"""
+        stages = baby.get('life_stages') or []
+        compiled = {None: render_prompt(baby['name'], baby['age'], baby['attributes'])}
+        for index, stage in enumerate(stages):
+            compiled[index] = render_prompt(baby['name'], baby['age'], baby['attributes'], stage)
+
+        version = baby.get('prompt_version', 1)
+        with self._lock:
+            for index, prompt in compiled.items():
+                self._prompts[(baby['id'], index, version)] = prompt
+                self._prompts.move_to_end((baby['id'], index, version))
+            while len(self._prompts) > self.max_entries:
+                self._prompts.popitem(last=False)
+        return compiled
+
+    def get(self, baby, stage_index=None):
+        """Return the prompt for a baby row and stage index
+
+        Raises IndexError if the stage index does not exist for this baby.
+        """
+        stages = baby.get('life_stages') or []
+        if stage_index is not None and not 0 <= stage_index < len(stages):
+            raise IndexError(f'Invalid stage index: {stage_index}')
+
+        key = (baby['id'], stage_index, baby.get('prompt_version', 1))
+        with self._lock:
+            prompt = self._prompts.get(key)
+            if prompt is not None:
+                self._prompts.move_to_end(key)
+                return prompt
+
+        return self.compile(baby)[stage_index]
+
+personas = PersonaRegistry()
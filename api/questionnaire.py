@@ -2,11 +2,10 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.utils import secure_filename
 from .database import get_db
+from .compression import compress
 from .config import Config
+from .idempotency import idempotent
 import os
-import base64
-from PIL import Image
-from io import BytesIO
 
 questionnaire_bp = Blueprint('questionnaire', __name__)
 
@@ -20,7 +19,7 @@ def allowed_file(filename):
 def get_questionnaire():
     email = get_jwt_identity()
 
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT id FROM users WHERE email = %s', (email,))
         user = cursor.fetchone()
@@ -44,6 +43,7 @@ def get_questionnaire():
 
 @questionnaire_bp.route('/questionnaire', methods=['POST'])
 @jwt_required()
+@idempotent('questionnaire')
 def save_questionnaire():
     email = get_jwt_identity()
     data = request.json
@@ -78,6 +78,7 @@ def save_questionnaire():
 
 @questionnaire_bp.route('/questionnaire/upload', methods=['POST'])
 @jwt_required()
+@idempotent('upload')
 def upload_image():
     email = get_jwt_identity()
 
@@ -146,10 +147,11 @@ def upload_image():
 
 @questionnaire_bp.route('/questionnaires/all', methods=['GET'])
 @jwt_required()
+@compress
 def get_all_questionnaires():
     email = get_jwt_identity()
 
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
         user = cursor.fetchone()
@@ -0,0 +1,216 @@
+"""
+Token-bucket rate limiting.
+
+Buckets live in process memory by default. Set RATELIMIT_STORAGE=postgres
+to keep them in the rate_limit_buckets table instead, so limits hold
+across gunicorn workers and instances. Stacked @rate_limit decorators
+are checked together, so a request costs one store call (one round trip
+with postgres) however many buckets apply.
+
+Usage (below @jwt_required so the user key is available):
+
+    @chat_bp.route('/chat/<int:baby_id>', methods=['POST'])
+    @jwt_required()
+    @rate_limit('chat', 10, 60, key='user')
+    def send_message(baby_id): ...
+"""
+
+import math
+import threading
+import time
+from collections import namedtuple
+from functools import wraps
+import psycopg2
+from flask import request, jsonify, g
+from flask_jwt_extended import get_jwt_identity
+from .config import Config
+from .database import ConnectionPool
+
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'limit', 'remaining', 'reset'])
+
+class MemoryBucketStore:
+    """Per-process buckets: {key: (tokens, last_refill, seconds_to_full)}"""
+
+    PRUNE_EVERY = 10000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def consume(self, key, capacity, refill_rate, cost=1):
+        """Take `cost` tokens from the bucket; returns (allowed, tokens_left)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, _ = self._buckets.get(key, (capacity, now, 0))
+            tokens = min(capacity, tokens + (now - last) * refill_rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now, capacity / refill_rate)
+
+            self._calls += 1
+            if self._calls % self.PRUNE_EVERY == 0:
+                self._prune(now)
+
+        return allowed, tokens
+
+    def consume_many(self, buckets):
+        """Consume (key, capacity, refill_rate, cost) buckets in order, stopping at the first empty one
+
+        Returns (allowed, tokens_left) for each bucket checked.
+        """
+        results = []
+        for bucket in buckets:
+            results.append(self.consume(*bucket))
+            if not results[-1][0]:
+                break
+        return results
+
+    def _prune(self, now):
+        # Buckets that have refilled completely carry no state worth keeping
+        idle = [k for k, (_, last, to_full) in self._buckets.items() if now - last > to_full]
+        for key in idle:
+            del self._buckets[key]
+
+class PostgresBucketStore:
+    """Buckets shared through the rate_limit_buckets table
+
+    All buckets of a request are consumed by one call to the consume_rate_limits()
+    function (see init_db), on pooled autocommit connections: one round trip per
+    request, with no process-wide lock.
+    """
+
+    CONSUME_SQL = 'SELECT consume_rate_limits(%s::text[], %s::float8[], %s::float8[], %s::float8[]) AS tokens'
+
+    def __init__(self, dsn):
+        # Separate from the get_db pool because these connections run in autocommit mode
+        self._pool = ConnectionPool(dsn, max(Config.DB_POOL_MAX, 1))
+        # Used when the database is unreachable, so an outage does not take down login/chat
+        self._fallback = MemoryBucketStore()
+
+    def consume_many(self, buckets):
+        keys, capacities, rates, costs = (list(column) for column in zip(*buckets))
+        try:
+            conn = self._pool.getconn()
+        except psycopg2.Error:
+            return self._fallback.consume_many(buckets)
+
+        broken = False
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(self.CONSUME_SQL, (keys, capacities, rates, costs))
+            tokens = cursor.fetchone()['tokens']
+        except psycopg2.Error:
+            broken = True
+            return self._fallback.consume_many(buckets)
+        finally:
+            self._pool.putconn(conn, discard=broken)
+
+        # NULL marks the bucket that was empty; the ones after it were not checked
+        return [(left is not None, left if left is not None else 0.0) for left in tokens]
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the process-wide bucket store, created on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if Config.RATELIMIT_STORAGE == 'postgres':
+                    _store = PostgresBucketStore(Config.DATABASE_URL)
+                else:
+                    _store = MemoryBucketStore()
+    return _store
+
+def _client_ip():
+    return request.remote_addr or 'unknown'
+
+def _resolve_key(key):
+    if callable(key):
+        return key()
+    if key == 'user':
+        return get_jwt_identity() or _client_ip()
+    if key == 'ip':
+        return _client_ip()
+    if key == 'global':
+        return '*'
+    raise ValueError(f'Unknown rate limit key: {key}')
+
+def check_rate_limits(limits):
+    """Consume from each (scope, limit, period, key, cost) bucket in one store call
+
+    Buckets are checked in order and checking stops at the first empty one,
+    whose result is last in the returned list of RateLimitResult.
+    """
+    buckets = []
+    for scope, limit, period, key, cost in limits:
+        label = key.__name__ if callable(key) else key
+        bucket_key = f'{scope}:{label}:{_resolve_key(key)}'
+        buckets.append((bucket_key, limit, limit / period, cost() if callable(cost) else cost))
+
+    results = []
+    for (_, limit, refill_rate, cost), (allowed, tokens) in zip(buckets, get_store().consume_many(buckets)):
+        if allowed:
+            reset = math.ceil((limit - tokens) / refill_rate)
+        else:
+            reset = math.ceil((cost - tokens) / refill_rate)
+        results.append(RateLimitResult(allowed, limit, int(tokens), reset))
+    return results
+
+def rate_limit(scope, limit, period, key='user', cost=1):
+    """Decorator: reject with 429 once the bucket for this scope and key is empty
+
+    key is 'user' (JWT identity), 'ip', 'global', or a callable returning a string.
+    cost is the tokens one request takes, or a callable returning it (e.g. from the body).
+    Stacked rate_limit decorators share one wrapper, so a request's buckets are
+    checked together (outermost first) in a single store call.
+    """
+    spec = (scope, limit, period, key, cost)
+
+    def decorator(view):
+        if hasattr(view, 'rate_limits'):
+            view.rate_limits.insert(0, spec)
+            return view
+
+        limits = [spec]
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not Config.RATELIMIT_ENABLED:
+                return view(*args, **kwargs)
+
+            results = check_rate_limits(limits)
+
+            # Report the most restrictive limit that applied to this request
+            for result in results:
+                current = g.get('rate_limit')
+                if current is None or result.remaining < current.remaining or not result.allowed:
+                    g.rate_limit = result
+
+            if not results[-1].allowed:
+                return jsonify({'error': 'Too many requests', 'retry_after': results[-1].reset}), 429
+
+            return view(*args, **kwargs)
+
+        wrapper.rate_limits = limits
+        return wrapper
+    return decorator
+
+def init_rate_limiting(app):
+    """Add RateLimit-* and Retry-After headers to rate limited responses"""
+    @app.after_request
+    def add_rate_limit_headers(response):
+        result = g.get('rate_limit')
+        if result is None:
+            return response
+
+        response.headers['RateLimit-Limit'] = str(result.limit)
+        response.headers['RateLimit-Remaining'] = str(result.remaining)
+        response.headers['RateLimit-Reset'] = str(result.reset)
+        if not result.allowed:
+            response.headers['Retry-After'] = str(result.reset)
+        return response
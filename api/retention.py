@@ -0,0 +1,239 @@
+"""
+Chat retention: archive old months of chat_messages to disk and drop them.
+
+chat_messages is partitioned by month (see database._create_chat_messages).
+Once a month is older than CHAT_RETENTION_DAYS, its messages are appended to
+ARCHIVE_FOLDER/chat/<user_id>/<baby_id>.ndjson.gz (one JSON message per
+line; each run writes a new file and swaps it in, so a crash never leaves
+a half-written archive), then the partition is detached with
+DETACH PARTITION CONCURRENTLY and dropped, so the hot table only holds the
+retention window. The concurrent detach never holds a lock that blocks
+reads or writes of chat_messages (a plain DROP TABLE would lock the whole
+table until it committed). Archived messages keep their ids and are merged
+back in by get_chat_history and summaries.load_context.
+
+The same run prunes change_log rows older than CHANGE_LOG_RETENTION_HOURS.
+
+Run daily, e.g. from cron (this also creates the upcoming partitions):
+    python -m api.retention [--days 180] [--dry-run]
+"""
+
+import argparse
+import gzip
+import itertools
+import json
+import logging
+import os
+import re
+import zlib
+from datetime import date, datetime, timedelta
+from .config import Config
+from .database import get_db, get_db_connection, ensure_chat_partitions, add_months
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.path.join(os.path.dirname(__file__), '..', Config.ARCHIVE_FOLDER, 'chat')
+
+PARTITION_PATTERN = re.compile(r'^chat_messages_y(\d{4})m(\d{2})$')
+
+def archive_path(user_id, baby_id):
+    return os.path.join(ARCHIVE_DIR, str(user_id), f'{baby_id}.ndjson.gz')
+
+def _read_members(path):
+    """Decompressed gzip members of an archive file, skipping damaged ones
+
+    Archives written before runs swapped in whole files may hold a member
+    truncated by a crash, followed by good members from later runs (the
+    crashed run's rows were never dropped and were archived again).
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    pos = 0
+    while pos < len(data):
+        decompressor = zlib.decompressobj(wbits=31)  # gzip framing, with CRC check
+        try:
+            chunk = decompressor.decompress(data[pos:])
+            if not decompressor.eof:
+                raise zlib.error('truncated member')
+        except zlib.error:
+            logger.warning('Skipping a damaged member in %s at byte %d', path, pos)
+            pos = data.find(b'\x1f\x8b\x08', pos + 1)
+            if pos < 0:
+                return
+            continue
+        yield chunk
+        pos = len(data) - len(decompressor.unused_data)
+
+def load_archived(user_id, baby_id, after_id=0):
+    """Archived messages of one conversation with id > after_id, oldest first"""
+    path = archive_path(user_id, baby_id)
+    if not os.path.exists(path):
+        return []
+
+    messages = {}
+    try:
+        for chunk in _read_members(path):
+            for line in chunk.decode('utf-8').splitlines():
+                m = json.loads(line)
+                if m['id'] > after_id:
+                    messages[m['id']] = m
+    except (OSError, ValueError, KeyError):
+        # Serve the hot history rather than failing every request for this conversation
+        logger.exception('Unreadable chat archive %s', path)
+
+    for m in messages.values():
+        m['created_at'] = datetime.fromisoformat(m['created_at'])
+    return sorted(messages.values(), key=lambda m: m['id'])
+
+def with_archived(user_id, baby_id, rows, after_id=0):
+    """Prepend archived messages to hot chat_messages rows (both ordered by id)"""
+    archived = load_archived(user_id, baby_id, after_id)
+    if not archived:
+        return rows
+    hot_ids = {r['id'] for r in rows}
+    return [m for m in archived if m['id'] not in hot_ids] + list(rows)
+
+def _write_conversation(user_id, baby_id, messages):
+    """Merge messages into the conversation's archive via a fsynced temp file and os.replace"""
+    path = archive_path(user_id, baby_id)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    merged = {m['id']: m for m in load_archived(user_id, baby_id)}
+    merged.update((m['id'], m) for m in messages)
+
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as gz:
+                for m in sorted(merged.values(), key=lambda m: m['id']):
+                    gz.write((json.dumps({
+                        'id': m['id'],
+                        'message': m['message'],
+                        'role': m['role'],
+                        'created_at': m['created_at'].isoformat()
+                    }) + '\n').encode())
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    # Make the rename itself durable before the partition is dropped
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _archive_rows(conn, source):
+    """Stream rows of one partition to the archive, grouped by conversation; returns the row count"""
+    count = 0
+    cursor = conn.cursor(name=f'archive_{source}')
+    cursor.itersize = 5000
+    cursor.execute(
+        f'''
+        SELECT id, user_id, baby_id, message, role, created_at
+        FROM {source}
+        ORDER BY user_id, baby_id, id
+        '''
+    )
+    for (user_id, baby_id), messages in itertools.groupby(cursor, key=lambda m: (m['user_id'], m['baby_id'])):
+        messages = list(messages)
+        _write_conversation(user_id, baby_id, messages)
+        count += len(messages)
+    cursor.close()
+    return count
+
+def expired_partitions(cursor, cutoff):
+    """Monthly tables whose whole range is older than `cutoff`, oldest first, as [(name, state)]
+
+    state is 'attached', 'detaching' (a DETACH ... CONCURRENTLY that was
+    interrupted) or 'detached' (a run that stopped before dropping it).
+    """
+    cursor.execute('''
+        SELECT c.relname, i.inhdetachpending
+        FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'chat_messages'::regclass
+        WHERE c.relkind = 'r'
+        AND c.relnamespace = (SELECT relnamespace FROM pg_class WHERE oid = 'chat_messages'::regclass)
+    ''')
+    expired = []
+    for row in cursor.fetchall():
+        match = PARTITION_PATTERN.match(row['relname'])
+        if match:
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            if add_months(month, 1) <= cutoff:
+                state = 'detached' if row['inhdetachpending'] is None else 'detaching' if row['inhdetachpending'] else 'attached'
+                expired.append((month, row['relname'], state))
+    return [(name, state) for _, name, state in sorted(expired)]
+
+def run_retention(days=None, dry_run=False):
+    """Archive, detach and drop every month older than `days`; returns {partition: archived rows}"""
+    days = Config.CHAT_RETENTION_DAYS if days is None else days
+    cutoff = date.today() - timedelta(days=days)
+    archived = {}
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        partitions = expired_partitions(cursor, cutoff)
+        if not dry_run:
+            ensure_chat_partitions(cursor)
+
+    if dry_run:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            for name, _ in partitions:
+                cursor.execute(f'SELECT COUNT(*) AS count FROM {name}')
+                archived[name] = cursor.fetchone()['count']
+        return archived
+
+    # DETACH ... CONCURRENTLY cannot run inside a transaction block, so it gets its own autocommit connection
+    ddl = get_db_connection()
+    try:
+        ddl.autocommit = True
+        cursor = ddl.cursor()
+        cursor.execute("SET lock_timeout = '5s'")
+
+        for name, state in partitions:
+            # Archive while the month is still attached, so history never has a gap; the files are
+            # fsynced before the drop, and a failed run leaves the table to be archived again
+            # (archives are merged by id)
+            with get_db() as conn:
+                archived[name] = _archive_rows(conn, name)
+
+            if state == 'attached':
+                cursor.execute(f'ALTER TABLE chat_messages DETACH PARTITION {name} CONCURRENTLY')
+            elif state == 'detaching':
+                cursor.execute(f'ALTER TABLE chat_messages DETACH PARTITION {name} FINALIZE')
+            cursor.execute(f'DROP TABLE {name}')
+    finally:
+        ddl.close()
+
+    return archived
+
+def prune_change_log():
+    """Delete admin change feed rows older than CHANGE_LOG_RETENTION_HOURS; returns the row count"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'DELETE FROM change_log WHERE created_at < LOCALTIMESTAMP - make_interval(hours => %s)',
+            (Config.CHANGE_LOG_RETENTION_HOURS,)
+        )
+        return cursor.rowcount
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=Config.CHAT_RETENTION_DAYS)
+    parser.add_argument('--dry-run', action='store_true', help='only report what would be archived')
+    args = parser.parse_args()
+
+    for source, count in run_retention(args.days, args.dry_run).items():
+        print(f"{'would archive' if args.dry_run else 'archived'} {count} messages from {source}")
+    if not args.dry_run:
+        print(f'pruned {prune_change_log()} change_log rows')
+
+if __name__ == '__main__':
+    main()
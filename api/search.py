@@ -0,0 +1,314 @@
+import base64
+import json
+from datetime import datetime
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from .database import get_db
+from .compression import compress
+
+search_bp = Blueprint('search', __name__)
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# Full-text config used by the GIN indexes in init_db; queries must spell the same expression to use them
+TS_CONFIG = 'simple'
+
+class BadRequest(ValueError):
+    pass
+
+def encode_cursor(timestamp, row_id):
+    """Opaque keyset cursor for (timestamp, id) ordering"""
+    raw = json.dumps([timestamp.isoformat() if timestamp else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (datetime.fromisoformat(timestamp) if timestamp else None), int(row_id)
+    except (ValueError, TypeError):
+        raise BadRequest('Invalid cursor')
+
+def _limit():
+    try:
+        limit = int(request.args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest('Invalid limit')
+    return max(1, min(limit, MAX_LIMIT))
+
+def _int_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f'Invalid {name}')
+
+def _bool_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if value.lower() not in ('true', 'false'):
+        raise BadRequest(f'Invalid {name}')
+    return value.lower() == 'true'
+
+def _is_admin(cursor, email):
+    cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
+    user = cursor.fetchone()
+    return bool(user) and user['role'] == 'admin'
+
+def _page(rows, limit, key):
+    """Trim the look-ahead row and build the next cursor"""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(*key(rows[-1])) if has_more else None
+    return rows, next_cursor
+
+def _run_search(build):
+    """Shared admin check, argument errors and pagination for the search endpoints"""
+    email = get_jwt_identity()
+    try:
+        limit = _limit()
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        sql, params, key, serialize = build(after, limit + 1)
+    except BadRequest as e:
+        return jsonify({'error': str(e)}), 400
+
+    with get_db(readonly=True) as conn:
+        cursor = conn.cursor()
+        if not _is_admin(cursor, email):
+            return jsonify({'error': 'Unauthorized'}), 403
+
+        cursor.execute(sql, params)
+        rows, next_cursor = _page(cursor.fetchall(), limit, key)
+
+        return jsonify({
+            'results': [serialize(r) for r in rows],
+            'next_cursor': next_cursor
+        }), 200
+
+@search_bp.route('/search/users', methods=['GET'])
+@jwt_required()
+@compress
+def search_users():
+    """Admin only: Search users
+
+    ?email=<prefix>&role=user&has_selected_baby=true&answered=<question key>
+    &min_messages=<n>&max_messages=<n>&limit=50&cursor=<next_cursor>
+    """
+    def build(after, fetch):
+        conditions, params = [], {'fetch': fetch}
+
+        email_prefix = request.args.get('email')
+        if email_prefix:
+            conditions.append("lower(u.email) LIKE %(email_prefix)s")
+            params['email_prefix'] = email_prefix.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+        if request.args.get('role'):
+            conditions.append('u.role = %(role)s')
+            params['role'] = request.args['role']
+
+        has_selected = _bool_arg('has_selected_baby')
+        if has_selected is not None:
+            conditions.append('u.selected_baby_id IS NOT NULL' if has_selected else 'u.selected_baby_id IS NULL')
+
+        if request.args.get('answered'):
+            # jsonb ? key is served by the GIN index on questionnaires.answers
+            conditions.append('q.answers ? %(answered)s')
+            params['answered'] = request.args['answered']
+
+        min_messages, max_messages = _int_arg('min_messages'), _int_arg('max_messages')
+        if min_messages is not None:
+            conditions.append('COALESCE(m.message_count, 0) >= %(min_messages)s')
+            params['min_messages'] = min_messages
+        if max_messages is not None:
+            conditions.append('COALESCE(m.message_count, 0) <= %(max_messages)s')
+            params['max_messages'] = max_messages
+
+        if after:
+            conditions.append('(u.created_at, u.id) < (%(after_ts)s, %(after_id)s)')
+            params['after_ts'], params['after_id'] = after
+
+        where = ' AND '.join(conditions) or 'TRUE'
+        sql = f'''
+            SELECT u.id, u.email, u.role, u.selected_baby_id, u.created_at,
+                   q.updated_at AS questionnaire_updated_at,
+                   COALESCE(m.message_count, 0) AS message_count
+            FROM users u
+            LEFT JOIN questionnaires q ON q.user_id = u.id
+            LEFT JOIN LATERAL (
+                SELECT SUM(cs.message_count) AS message_count
+                FROM chat_sessions cs WHERE cs.user_id = u.id
+            ) m ON TRUE
+            WHERE {where}
+            ORDER BY u.created_at DESC, u.id DESC
+            LIMIT %(fetch)s
+        '''
+
+        def serialize(u):
+            return {
+                'id': u['id'],
+                'email': u['email'],
+                'role': u['role'],
+                'selected_baby_id': u['selected_baby_id'],
+                'message_count': int(u['message_count']),
+                'questionnaire_updated_at': u['questionnaire_updated_at'].isoformat() if u['questionnaire_updated_at'] else None,
+                'created_at': u['created_at'].isoformat() if u['created_at'] else None
+            }
+
+        return sql, params, lambda u: (u['created_at'], u['id']), serialize
+
+    return _run_search(build)
+
+@search_bp.route('/search/questionnaires', methods=['GET'])
+@jwt_required()
+@compress
+def search_questionnaires():
+    """Admin only: Full-text and filtered search over questionnaire answers
+
+    ?q=<words>&answered=<question key>&limit=50&cursor=<next_cursor>
+    """
+    def build(after, fetch):
+        conditions, params = ["u.role = 'user'"], {'fetch': fetch}
+
+        if request.args.get('q'):
+            conditions.append(f"to_tsvector('{TS_CONFIG}', q.answers) @@ websearch_to_tsquery('{TS_CONFIG}', %(q)s)")
+            params['q'] = request.args['q']
+
+        if request.args.get('answered'):
+            conditions.append('q.answers ? %(answered)s')
+            params['answered'] = request.args['answered']
+
+        if after:
+            conditions.append('(q.updated_at, q.id) < (%(after_ts)s, %(after_id)s)')
+            params['after_ts'], params['after_id'] = after
+
+        sql = f'''
+            SELECT q.id, u.id AS user_id, u.email, q.answers, q.image_paths, q.updated_at
+            FROM questionnaires q
+            JOIN users u ON u.id = q.user_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY q.updated_at DESC, q.id DESC
+            LIMIT %(fetch)s
+        '''
+
+        def serialize(q):
+            return {
+                'user_id': q['user_id'],
+                'email': q['email'],
+                'answers': q['answers'] or {},
+                'image_paths': q['image_paths'] or [],
+                'updated_at': q['updated_at'].isoformat() if q['updated_at'] else None
+            }
+
+        return sql, params, lambda q: (q['updated_at'], q['id']), serialize
+
+    return _run_search(build)
+
+@search_bp.route('/search/messages', methods=['GET'])
+@jwt_required()
+@compress
+def search_messages():
+    """Admin only: Full-text search over chat transcripts
+
+    ?q=<words>&user_id=<id>&baby_id=<id>&role=user|assistant&limit=50&cursor=<next_cursor>
+    """
+    def build(after, fetch):
+        if not request.args.get('q'):
+            raise BadRequest('q required')
+
+        conditions = [f"to_tsvector('{TS_CONFIG}', m.message) @@ websearch_to_tsquery('{TS_CONFIG}', %(q)s)"]
+        params = {'fetch': fetch, 'q': request.args['q']}
+
+        for name in ('user_id', 'baby_id'):
+            value = _int_arg(name)
+            if value is not None:
+                conditions.append(f'm.{name} = %({name})s')
+                params[name] = value
+
+        if request.args.get('role'):
+            conditions.append('m.role = %(role)s')
+            params['role'] = request.args['role']
+
+        if after:
+            conditions.append('(m.created_at, m.id) < (%(after_ts)s, %(after_id)s)')
+            params['after_ts'], params['after_id'] = after
+
+        sql = f'''
+            SELECT m.id, m.user_id, u.email, m.baby_id, m.message, m.role, m.created_at
+            FROM chat_messages m
+            JOIN users u ON u.id = m.user_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY m.created_at DESC, m.id DESC
+            LIMIT %(fetch)s
+        '''
+
+        def serialize(m):
+            return {
+                'id': m['id'],
+                'user_id': m['user_id'],
+                'email': m['email'],
+                'baby_id': m['baby_id'],
+                'message': m['message'],
+                'role': m['role'],
+                'timestamp': m['created_at'].isoformat()
+            }
+
+        return sql, params, lambda m: (m['created_at'], m['id']), serialize
+
+    return _run_search(build)
+
+@search_bp.route('/search/babies', methods=['GET'])
+@jwt_required()
+@compress
+def search_babies():
+    """Admin only: Find babies by attributes and assignment
+
+    ?attribute=smart&attribute=curious (all must match)&user_id=<id>&is_visible=true&limit=50&cursor=<next_cursor>
+    """
+    def build(after, fetch):
+        conditions, params = [], {'fetch': fetch}
+
+        attributes = request.args.getlist('attribute')
+        if attributes:
+            # Array containment is served by the GIN index on babies.attributes
+            conditions.append('b.attributes @> %(attributes)s::text[]')
+            params['attributes'] = attributes
+
+        user_id = _int_arg('user_id')
+        if user_id is not None:
+            conditions.append('b.user_id = %(user_id)s')
+            params['user_id'] = user_id
+
+        is_visible = _bool_arg('is_visible')
+        if is_visible is not None:
+            conditions.append('b.is_visible = %(is_visible)s')
+            params['is_visible'] = is_visible
+
+        if after:
+            conditions.append('(b.created_at, b.id) < (%(after_ts)s, %(after_id)s)')
+            params['after_ts'], params['after_id'] = after
+
+        sql = f'''
+            SELECT b.id, b.name, b.age, b.attributes, b.image_path, b.is_visible, b.user_id, b.created_at
+            FROM babies b
+            WHERE {' AND '.join(conditions) or 'TRUE'}
+            ORDER BY b.created_at DESC, b.id DESC
+            LIMIT %(fetch)s
+        '''
+
+        def serialize(b):
+            return {
+                'id': b['id'],
+                'name': b['name'],
+                'age': b['age'],
+                'attributes': b['attributes'],
+                'image_path': b['image_path'],
+                'is_visible': b['is_visible'],
+                'user_id': b['user_id']
+            }
+
+        return sql, params, lambda b: (b['created_at'], b['id']), serialize
+
+    return _run_search(build)
@@ -1,10 +1,10 @@
 """
 Script to seed the database with sample babies.
-Run this after initializing the database.
+Run this after initializing the database: python -m api.seed_babies
 """
 
 import json
-from database import get_db
+from .database import get_db
 
 def seed_babies():
     """Add sample babies to the database"""
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from psycopg2.extras import execute_values
 from .database import get_db
 
 settings_bp = Blueprint('settings', __name__)
@@ -8,7 +9,7 @@ settings_bp = Blueprint('settings', __name__)
 @jwt_required()
 def get_settings():
     """Get all settings (anyone can view)"""
-    with get_db() as conn:
+    with get_db(readonly=True) as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT key, value FROM settings')
         settings = cursor.fetchall()
@@ -38,3 +39,46 @@ def toggle_questionnaires_lock():
         )
 
         return jsonify({'message': 'Questionnaire lock updated', 'is_locked': is_locked}), 200
+
+@settings_bp.route('/settings', methods=['POST'])
+@jwt_required()
+def update_settings():
+    """Admin only: Update several settings at once, e.g. {"settings": {"questionnaires_locked": true}}"""
+    email = get_jwt_identity()
+    data = request.json
+    settings = data.get('settings')
+
+    if not isinstance(settings, dict) or not settings:
+        return jsonify({'error': 'Settings required'}), 400
+    if not all(isinstance(value, bool) for value in settings.values()):
+        return jsonify({'error': 'Setting values must be booleans'}), 400
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
+        user = cursor.fetchone()
+
+        if not user or user['role'] != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 403
+
+        # Only existing keys are updated; report any that are unknown
+        updated = execute_values(
+            cursor,
+            '''
+            UPDATE settings AS s SET value = v.value
+            FROM (VALUES %s) AS v(key, value)
+            WHERE s.key = v.key
+            RETURNING s.key
+            ''',
+            list(settings.items()),
+            template='(%s, %s::boolean)',
+            page_size=len(settings),
+            fetch=True
+        )
+
+        unknown = sorted(set(settings) - {row['key'] for row in updated})
+        if unknown:
+            conn.rollback()
+            return jsonify({'error': 'Setting not found', 'keys': unknown}), 404
+
+        return jsonify({'message': 'Settings updated', 'settings': settings}), 200
@@ -0,0 +1,117 @@
+"""
+Rolling conversation summaries for long-lived chats.
+
+With CHAT_LONG_MODE enabled, once a conversation has more than
+CHAT_SUMMARY_TRIGGER_TURNS unsummarized turns, everything but the last
+CHAT_RECENT_TURNS turns is folded into chat_summaries by a background job.
+The prompt for the next reply is then the system prompt plus the summary
+plus the recent turns, so its size stays flat however long the chat gets.
+"""
+
+from .config import Config
+from .database import get_db
+from .llm import get_client, response_text
+from .tasks import submit_once
+from .retention import with_archived
+from .greetings import GREETING_REQUEST
+from .usage import usage
+
+SUMMARY_SYSTEM_PROMPT = """You maintain a running summary of a conversation between a user and a baby character.
+Update the summary with the new messages. Keep names, facts the user shared, promises, running jokes and the
+emotional tone. Write in third person, at most 200 words. Reply with the summary only."""
+
+def load_context(cursor, user_id, baby_id):
+    """Return (summary, messages) to send to the model for this conversation
+
+    messages are the turns not yet folded into the summary, oldest first.
+    Without long mode the summary is None and messages is the full history.
+    """
+    summary, through_id = None, 0
+
+    if Config.CHAT_LONG_MODE:
+        cursor.execute(
+            'SELECT summary, summarized_through_id FROM chat_summaries WHERE user_id = %s AND baby_id = %s',
+            (user_id, baby_id)
+        )
+        row = cursor.fetchone()
+        if row:
+            summary, through_id = row['summary'], row['summarized_through_id']
+
+    cursor.execute(
+        '''
+        SELECT id, message, role
+        FROM chat_messages
+        WHERE user_id = %s AND baby_id = %s AND id > %s
+        ORDER BY id ASC
+        ''',
+        (user_id, baby_id, through_id)
+    )
+    return summary, with_archived(user_id, baby_id, cursor.fetchall(), through_id)
+
+def build_prompt(system_prompt, summary, history):
+    """Assemble (system, messages) for messages.create()"""
+    if summary:
+        system_prompt = f"{system_prompt}\n\nWhat has happened in this conversation so far:\n{summary}"
+
+    messages = [{'role': 'user' if h['role'] == 'user' else 'assistant', 'content': h['message']} for h in history]
+
+    # The model expects the conversation to open with a user turn; an opening greeting answers this one
+    if messages and messages[0]['role'] != 'user':
+        messages.insert(0, {'role': 'user', 'content': GREETING_REQUEST})
+
+    return system_prompt, messages
+
+def maybe_schedule_summary(user_id, baby_id, unsummarized_count):
+    """Queue a summary refresh once the unsummarized tail exceeds the trigger size"""
+    if not Config.CHAT_LONG_MODE:
+        return None
+    if unsummarized_count <= Config.CHAT_SUMMARY_TRIGGER_TURNS * 2:
+        return None
+    return submit_once(('summary', user_id, baby_id), summarize_conversation, user_id, baby_id)
+
+def summarize_conversation(user_id, baby_id, client=None):
+    """Fold all but the most recent turns into the stored summary
+
+    Returns the new summary, or None if there was nothing to fold.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        summary, history = load_context(cursor, user_id, baby_id)
+
+    # Keep the last CHAT_RECENT_TURNS turns verbatim, starting on a user message
+    split = max(len(history) - Config.CHAT_RECENT_TURNS * 2, 0)
+    while split < len(history) and history[split]['role'] != 'user':
+        split += 1
+    to_fold = history[:split]
+    if not to_fold:
+        return None
+
+    transcript = "\n".join(f"{h['role']}: {h['message']}" for h in to_fold)
+    content = f"Current summary:\n{summary or '(none yet)'}\n\nNew messages:\n{transcript}"
+
+    response = (client or get_client()).messages.create(
+        model=Config.CHAT_SUMMARY_MODEL,
+        max_tokens=512,
+        system=SUMMARY_SYSTEM_PROMPT,
+        messages=[{'role': 'user', 'content': content}]
+    )
+    usage.record(user_id, baby_id, Config.CHAT_SUMMARY_MODEL, 'summary', response)
+    new_summary = response_text(response)
+
+    # The model call happens outside the transaction; only move the summary forward
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            '''
+            INSERT INTO chat_summaries (user_id, baby_id, summary, summarized_through_id, updated_at)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id, baby_id)
+            DO UPDATE SET summary = EXCLUDED.summary,
+                          summarized_through_id = EXCLUDED.summarized_through_id,
+                          updated_at = CURRENT_TIMESTAMP
+            WHERE chat_summaries.summarized_through_id < EXCLUDED.summarized_through_id
+            ''',
+            (user_id, baby_id, new_summary, to_fold[-1]['id'])
+        )
+
+    return new_summary
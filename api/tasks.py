@@ -0,0 +1,58 @@
+"""
+Background work that should not add latency to a request.
+
+Jobs run on a small thread pool inside the web process. Jobs submitted
+with the same key while one is already queued or running are dropped,
+so bursts of requests for one conversation produce a single job.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=Config.BACKGROUND_WORKERS, thread_name_prefix='background')
+_pending = set()
+_pending_lock = threading.Lock()
+
+def submit_once(key, fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) in the background unless a job with this key is pending
+
+    Returns the Future, or None if the job was deduplicated.
+    """
+    with _pending_lock:
+        if key in _pending:
+            return None
+        _pending.add(key)
+
+    def run():
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            logger.exception('Background job %s failed', key)
+            raise
+        finally:
+            with _pending_lock:
+                _pending.discard(key)
+
+    try:
+        return _executor.submit(run)
+    except RuntimeError:
+        # Interpreter is shutting down
+        with _pending_lock:
+            _pending.discard(key)
+        raise
+
+def wait_idle(timeout=None):
+    """Block until no job is queued or running; returns False if timeout (seconds) ran out first"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        with _pending_lock:
+            if not _pending:
+                return True
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
@@ -0,0 +1,95 @@
+"""
+Access/refresh tokens and revocation.
+
+Every token carries a `ver` claim copied from users.token_version. Changing
+the password or logging out bumps the version, which invalidates every
+token issued before it. Validation compares the claim against an
+in-memory {email: version} map that is refreshed incrementally from the
+users table (only rows whose token_revoked_at moved). Refreshes run on
+their own thread, not the shared background pool where they would queue
+behind slow jobs, so checking a token only reads the map and never
+waits on the database; until the first load finishes only revocations
+made by this process are known.
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+from flask_jwt_extended import create_access_token, create_refresh_token
+from .config import Config
+from .database import get_db
+
+logger = logging.getLogger(__name__)
+
+class TokenVersionCache:
+    """Latest token_version for users that revoked tokens within the refresh-token lifetime"""
+
+    # Re-read a little behind the watermark so rows committed out of order are not missed
+    OVERLAP = timedelta(seconds=5)
+
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self._versions = {}
+        self._watermark = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current_version(self, email):
+        if time.monotonic() - self._checked_at >= self.refresh_interval:
+            # Claim this round before starting the thread so concurrent requests do not start more
+            self._checked_at = time.monotonic()
+            threading.Thread(target=self.refresh, name='token-versions', daemon=True).start()
+        return self._versions.get(email, 0)
+
+    def set_version(self, email, version):
+        """Record a revocation made by this process without waiting for the next refresh"""
+        if version > self._versions.get(email, 0):
+            self._versions[email] = version
+
+    def refresh(self):
+        # Only one thread refreshes; the others keep using the current map
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT LOCALTIMESTAMP AS now')
+                now = cursor.fetchone()['now']
+
+                if self._watermark is None:
+                    # Tokens older than the refresh lifetime are expired anyway
+                    since = now - timedelta(seconds=Config.JWT_REFRESH_TOKEN_EXPIRES)
+                else:
+                    since = self._watermark - self.OVERLAP
+
+                cursor.execute(
+                    'SELECT email, token_version FROM users WHERE token_revoked_at > %s',
+                    (since,)
+                )
+                for row in cursor.fetchall():
+                    self.set_version(row['email'], row['token_version'])
+
+            self._watermark = now
+        except Exception:
+            # Keep serving with the last known versions rather than failing every request
+            logger.exception('Failed to refresh token versions')
+        finally:
+            self._lock.release()
+
+token_versions = TokenVersionCache(Config.TOKEN_VERSION_REFRESH_SECONDS)
+
+def issue_tokens(email, version):
+    """Create an access/refresh token pair for a user at the given token version"""
+    claims = {'ver': version}
+    return {
+        'token': create_access_token(identity=email, additional_claims=claims),
+        'refresh_token': create_refresh_token(identity=email, additional_claims=claims)
+    }
+
+def init_tokens(jwt):
+    """Reject tokens issued before the user's latest revocation"""
+    @jwt.token_in_blocklist_loader
+    def is_token_revoked(jwt_header, jwt_payload):
+        return jwt_payload.get('ver', 0) < token_versions.current_version(jwt_payload['sub'])
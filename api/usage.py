@@ -0,0 +1,254 @@
+"""
+LLM token accounting and quotas.
+
+Every model call reports its token usage to `usage.record()`. Calls are
+summed in memory per (day, user, baby, model, purpose) and written to the
+llm_usage table in one upsert every USAGE_FLUSH_SECONDS (by a timer
+thread, so an idle process does not sit on its buffer) or
+USAGE_FLUSH_CALLS calls, off the request path. user_id 0 is work that
+belongs to no user (greetings).
+
+Quotas count input + output tokens per calendar month. A user's limit is
+users.token_quota, or TOKEN_QUOTAS[role] when that is NULL; 0 means
+unlimited. Usage still buffered in other processes is not visible, so a
+user can overshoot by at most one flush interval of their own traffic.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from datetime import date
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from psycopg2.extras import execute_values
+from .config import Config
+from .database import get_db
+from .compression import compress
+from .tasks import submit_once
+
+logger = logging.getLogger(__name__)
+
+usage_bp = Blueprint('usage', __name__)
+
+SYSTEM_USER = 0
+
+COUNTERS = ('calls', 'input_tokens', 'output_tokens', 'cache_read_tokens', 'cache_creation_tokens')
+
+class UsageRecorder:
+    """Buffer of per-call token counts, flushed to llm_usage in batches"""
+
+    FLUSH_SQL = f'''
+        INSERT INTO llm_usage (day, user_id, baby_id, model, purpose, {', '.join(COUNTERS)})
+        VALUES %s
+        ON CONFLICT (day, user_id, baby_id, model, purpose) DO UPDATE SET
+        {', '.join(f'{c} = llm_usage.{c} + EXCLUDED.{c}' for c in COUNTERS)}
+    '''
+
+    def __init__(self):
+        self._pending = {}
+        self._calls = 0  # calls recorded since the last flush
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._timer = None  # started with the first recorded call
+
+    def record(self, user_id, baby_id, model, purpose, response):
+        """Add the usage of one messages.create() response"""
+        usage = getattr(response, 'usage', None)
+        counts = (
+            1,
+            getattr(usage, 'input_tokens', 0) or 0,
+            getattr(usage, 'output_tokens', 0) or 0,
+            getattr(usage, 'cache_read_input_tokens', 0) or 0,
+            getattr(usage, 'cache_creation_input_tokens', 0) or 0,
+        )
+        key = (date.today(), user_id or SYSTEM_USER, baby_id or 0, model, purpose)
+        with self._lock:
+            current = self._pending.get(key, (0,) * len(COUNTERS))
+            self._pending[key] = tuple(a + b for a, b in zip(current, counts))
+            self._calls += 1
+            due = self._calls >= Config.USAGE_FLUSH_CALLS
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._flush_periodically, name='usage-flush', daemon=True)
+                self._timer.start()
+        if due:
+            submit_once(('usage-flush',), self.flush)
+
+    def _flush_periodically(self):
+        """Flush at least every USAGE_FLUSH_SECONDS, whether or not more calls are recorded"""
+        while True:
+            with self._lock:
+                wait = self._flushed_at + Config.USAGE_FLUSH_SECONDS - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                self.flush()
+            except Exception:
+                # The counts stay buffered for the next attempt
+                logger.exception('Failed to flush LLM usage')
+
+    def pending_tokens(self, user_id, month_start):
+        """Input + output tokens recorded for a user in this process but not yet flushed"""
+        with self._lock:
+            return sum(
+                counts[1] + counts[2]
+                for (day, uid, *_), counts in self._pending.items()
+                if uid == user_id and day >= month_start
+            )
+
+    def flush(self):
+        """Write buffered usage in one statement; returns the number of rows upserted"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._calls = 0
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return 0
+
+        rows = [key + counts for key, counts in pending.items()]
+        try:
+            with get_db(sticky=False) as conn:
+                execute_values(conn.cursor(), self.FLUSH_SQL, rows, page_size=len(rows))
+        except Exception:
+            # Put the counts back so the next flush retries them
+            with self._lock:
+                for key, counts in pending.items():
+                    current = self._pending.get(key, (0,) * len(COUNTERS))
+                    self._pending[key] = tuple(a + b for a, b in zip(current, counts))
+                    self._calls += counts[0]
+            raise
+        return len(rows)
+
+usage = UsageRecorder()
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        usage.flush()
+    except Exception:
+        logger.exception('Failed to flush LLM usage at exit')
+
+def _month_start():
+    return date.today().replace(day=1)
+
+def quota_status(cursor, user):
+    """(quota, used) for a users row with id, role and token_quota; quota 0 means unlimited"""
+    quota = user['token_quota']
+    if quota is None:
+        quota = Config.TOKEN_QUOTAS.get(user['role'], 0)
+    if not quota:
+        return 0, 0
+
+    month_start = _month_start()
+    cursor.execute(
+        'SELECT COALESCE(SUM(input_tokens + output_tokens), 0) AS used FROM llm_usage WHERE user_id = %s AND day >= %s',
+        (user['id'], month_start)
+    )
+    used = cursor.fetchone()['used'] + usage.pending_tokens(user['id'], month_start)
+    return quota, int(used)
+
+# group_by -> (select columns, group by columns)
+REPORT_GROUPS = {
+    'user': ('u.user_id, users.email', 'u.user_id, users.email'),
+    'baby': ('u.baby_id, babies.name AS baby_name', 'u.baby_id, babies.name'),
+    'model': ('u.model', 'u.model'),
+    'purpose': ('u.purpose', 'u.purpose'),
+    'day': ('u.day', 'u.day')
+}
+
+@usage_bp.route('/usage', methods=['GET'])
+@jwt_required()
+@compress
+def usage_report():
+    """Admin only: Token usage totals
+
+    ?group_by=user|baby|model|purpose|day&from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive, default this month)
+    """
+    email = get_jwt_identity()
+    group_by = request.args.get('group_by', 'user')
+    if group_by not in REPORT_GROUPS:
+        return jsonify({'error': f'group_by must be one of {", ".join(REPORT_GROUPS)}'}), 400
+    try:
+        start = date.fromisoformat(request.args['from']) if request.args.get('from') else _month_start()
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else date.today()
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+
+    # Include this process's buffered calls (before taking a connection for the report)
+    usage.flush()
+
+    with get_db(readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
+        user = cursor.fetchone()
+
+        if not user or user['role'] != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 403
+
+        select_columns, group_columns = REPORT_GROUPS[group_by]
+        totals = ', '.join(f'SUM(u.{c}) AS {c}' for c in COUNTERS)
+        cursor.execute(
+            f'''
+            SELECT {select_columns}, {totals}
+            FROM llm_usage u
+            LEFT JOIN users ON users.id = u.user_id
+            LEFT JOIN babies ON babies.id = u.baby_id
+            WHERE u.day BETWEEN %s AND %s
+            GROUP BY {group_columns}
+            ORDER BY SUM(u.input_tokens + u.output_tokens) DESC
+            ''',
+            (start, end)
+        )
+        rows = cursor.fetchall()
+
+    def serialize(row):
+        row = {k: (v.isoformat() if isinstance(v, date) else v) for k, v in row.items()}
+        for c in COUNTERS:
+            row[c] = int(row[c])
+        return row
+
+    return jsonify({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'group_by': group_by,
+        'rows': [serialize(r) for r in rows],
+        'totals': {c: sum(int(r[c]) for r in rows) for c in COUNTERS}
+    }), 200
+
+@usage_bp.route('/usage/quota', methods=['POST'])
+@jwt_required()
+def set_user_quota():
+    """Admin only: Set a user's monthly token quota
+
+    Body: {"user_id": 2, "token_quota": 500000} (0 = unlimited, null = role default)
+    """
+    email = get_jwt_identity()
+    data = request.json
+    user_id = data.get('user_id')
+    token_quota = data.get('token_quota')
+
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        return jsonify({'error': 'User ID required'}), 400
+    if token_quota is not None and (not isinstance(token_quota, int) or isinstance(token_quota, bool) or token_quota < 0):
+        return jsonify({'error': 'token_quota must be a non-negative integer or null'}), 400
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT role FROM users WHERE email = %s', (email,))
+        user = cursor.fetchone()
+
+        if not user or user['role'] != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 403
+
+        cursor.execute(
+            'UPDATE users SET token_quota = %s WHERE id = %s RETURNING id, role, token_quota',
+            (token_quota, user_id)
+        )
+        target = cursor.fetchone()
+        if not target:
+            return jsonify({'error': 'User not found'}), 404
+
+        quota, used = quota_status(cursor, target)
+
+    return jsonify({'user_id': user_id, 'token_quota': token_quota, 'effective_quota': quota, 'used': used}), 200
@@ -3,7 +3,7 @@
 import { useState, useEffect } from 'react'
 import { useRouter } from 'next/navigation'
 import { useAuthStore } from '@/lib/store'
-import { questionnaireAPI, babiesAPI, settingsAPI, authAPI } from '@/lib/api'
+import { questionnaireAPI, babiesAPI, settingsAPI, authAPI, changesAPI, Change } from '@/lib/api'
 import ImageModal from '../components/ImageModal'
 
 export default function AdminPage() {
@@ -31,12 +31,73 @@ export default function AdminPage() {
       return
     }
 
-    loadQuestionnaires()
-    loadBabies()
-    loadSettings()
-    loadUsers()
+    // Open the change feed first, then load: deltas that overlap the snapshot are full rows and apply idempotently
+    const loadAll = () => {
+      loadQuestionnaires()
+      loadBabies()
+      loadSettings()
+      loadUsers()
+    }
+    let loaded = false
+    const loadOnce = () => {
+      if (!loaded) loadAll()
+      loaded = true
+    }
+    // Don't leave the page empty if the feed is unavailable
+    const fallback = setTimeout(loadOnce, 3000)
+    const unsubscribe = changesAPI.subscribe(['users', 'questionnaires', 'babies'], {
+      onReady: loadOnce,
+      onReset: loadAll,
+      onChange: applyChange,
+    })
+    return () => {
+      clearTimeout(fallback)
+      unsubscribe()
+    }
   }, [user, router])
 
+  // Keep the loaded lists in sync with row-level changes instead of re-polling them
+  const applyChange = (change: Change) => {
+    const { table, op, row_id: id, row } = change
+
+    if (table === 'users') {
+      if (op === 'DELETE') {
+        setUsers((prev) => prev.filter((u) => u.id !== id))
+        setQuestionnaires((prev) => prev.filter((q) => q.user_id !== id))
+        return
+      }
+      const entry = { id, email: row.email, role: row.role, created_at: row.created_at }
+      setUsers((prev) => prev.some((u) => u.id === id)
+        ? prev.map((u) => (u.id === id ? { ...u, ...entry } : u))
+        : [entry, ...prev])
+      if (row.role === 'user') {
+        setQuestionnaires((prev) => prev.some((q) => q.user_id === id)
+          ? prev.map((q) => (q.user_id === id ? { ...q, email: row.email } : q))
+          : [...prev, { user_id: id, email: row.email, answers: {}, image_paths: [], updated_at: null }])
+      }
+    } else if (table === 'questionnaires') {
+      if (op === 'DELETE') return
+      setQuestionnaires((prev) => {
+        const updated = prev.map((q) => (q.user_id === row.user_id
+          ? { ...q, answers: row.answers || {}, image_paths: row.image_paths || [], updated_at: row.updated_at }
+          : q))
+        return [...updated].sort((a, b) => (b.updated_at || '').localeCompare(a.updated_at || ''))
+      })
+    } else if (table === 'babies') {
+      if (op === 'DELETE') {
+        setBabies((prev) => prev.filter((b) => b.id !== id))
+        return
+      }
+      const baby = {
+        id, name: row.name, age: row.age, attributes: row.attributes, image_path: row.image_path,
+        is_visible: row.is_visible, life_stages: row.life_stages || [], user_id: row.user_id,
+      }
+      setBabies((prev) => prev.some((b) => b.id === id)
+        ? prev.map((b) => (b.id === id ? baby : b))
+        : [...prev, baby])
+    }
+  }
+
   const loadUsers = async () => {
     try {
       const response = await authAPI.getAllUsers()
@@ -116,6 +177,7 @@ export default function AdminPage() {
   }
 
   const handleLogout = () => {
+    authAPI.logout().catch(() => {})
     logout()
     router.push('/login')
   }
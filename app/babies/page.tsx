@@ -74,6 +74,7 @@ export default function BabiesPage() {
   const handleChat = (baby: Baby, stage: LifeStage) => {
     // Store the selected stage in session storage for the chat page
     sessionStorage.setItem('selectedStage', JSON.stringify(stage))
+    sessionStorage.setItem('selectedStageIndex', String(baby.life_stages.indexOf(stage)))
     router.push(`/chat/${baby.id}`)
   }
 
@@ -21,10 +21,12 @@ export default function ChatPage() {
   const [input, setInput] = useState('')
   const [loading, setLoading] = useState(false)
   const [messageCount, setMessageCount] = useState(0)
+  const [messageLimit, setMessageLimit] = useState(20)
   const [limitReached, setLimitReached] = useState(false)
   const [showConfirmation, setShowConfirmation] = useState(false)
   const [baby, setBaby] = useState<any>(null)
   const [selectedStage, setSelectedStage] = useState<any>(null)
+  const [selectedStageIndex, setSelectedStageIndex] = useState<number | null>(null)
 
   const messagesEndRef = useRef<HTMLDivElement>(null)
 
@@ -39,8 +41,11 @@ export default function ChatPage() {
     if (stageData) {
       setSelectedStage(JSON.parse(stageData))
     }
+    const storedIndex = sessionStorage.getItem('selectedStageIndex')
+    const stageIndex = storedIndex !== null && parseInt(storedIndex) >= 0 ? parseInt(storedIndex) : null
+    setSelectedStageIndex(stageIndex)
 
-    loadChatHistory()
+    loadChatHistory(stageIndex)
     loadBabyInfo()
   }, [user, babyId, router])
 
@@ -58,12 +63,18 @@ export default function ChatPage() {
     }
   }
 
-  const loadChatHistory = async () => {
+  const loadChatHistory = async (stageIndex: number | null) => {
     try {
-      const response = await chatAPI.getHistory(babyId)
-      setMessages(response.data.messages)
+      const response = await chatAPI.getHistory(babyId, stageIndex)
+      const { messages, greeting } = response.data
+      // A new chat opens with the baby's pre-generated greeting
+      setMessages(messages.length === 0 && greeting
+        ? [{ message: greeting, role: 'assistant', timestamp: new Date().toISOString() }]
+        : messages)
       setMessageCount(response.data.message_count)
-      setLimitReached(response.data.message_count >= 20)
+      const limit = response.data.message_limit
+      setMessageLimit(limit)
+      setLimitReached(limit > 0 && response.data.message_count >= limit)
     } catch (err) {
       console.error('Failed to load chat history:', err)
     }
@@ -77,12 +88,8 @@ export default function ChatPage() {
     setLoading(true)
 
     try {
-      // Include stage information if available
-      const payload: any = { message: userMessage }
-      if (selectedStage) {
-        payload.stage = selectedStage
-      }
-      const response = await chatAPI.sendMessage(babyId, userMessage, selectedStage)
+      // The server builds the prompt from the baby's own life stage at this index
+      const response = await chatAPI.sendMessage(babyId, userMessage, selectedStageIndex)
 
       setMessages((prev) => [
         ...prev,
@@ -100,6 +107,9 @@ export default function ChatPage() {
       console.error('Failed to send message:', err)
       if (err.response?.data?.limit_reached) {
         setLimitReached(true)
+      } else if (err.response?.data?.quota_reached) {
+        setInput(userMessage)
+        alert("You've used up this month's chat allowance.")
       }
     } finally {
       setLoading(false)
@@ -139,7 +149,7 @@ export default function ChatPage() {
                 </p>
               )}
               <p className="text-sm text-gray-500">
-                Messages: {messageCount}/20 {limitReached && '(Limit reached)'}
+                Messages: {messageCount}{messageLimit > 0 && `/${messageLimit}`} {limitReached && '(Limit reached)'}
               </p>
             </div>
             <button
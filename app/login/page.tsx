@@ -25,9 +25,9 @@ export default function LoginPage() {
         ? await authAPI.login(email, password)
         : await authAPI.register(email, password)
 
-      const { token, role, email: userEmail } = response.data
+      const { token, refresh_token, role, email: userEmail } = response.data
 
-      setUser({ email: userEmail, role, token })
+      setUser({ email: userEmail, role, token, refresh_token })
 
       // Redirect based on role
       if (role === 'admin') {
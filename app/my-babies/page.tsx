@@ -62,6 +62,9 @@ export default function MyBabiesPage() {
   }
 
   const handleChatClick = (babyId: number) => {
+    // No stage chosen here: chat with the baby's default persona
+    sessionStorage.removeItem('selectedStage')
+    sessionStorage.removeItem('selectedStageIndex')
     router.push(`/chat/${babyId}`)
   }
 
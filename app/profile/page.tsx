@@ -8,7 +8,7 @@ import { authAPI } from '@/lib/api'
 
 export default function ProfilePage() {
   const router = useRouter()
-  const { user, logout } = useAuthStore()
+  const { user, setUser, logout } = useAuthStore()
   const [partner, setPartner] = useState('')
   const [currentPassword, setCurrentPassword] = useState('')
   const [newPassword, setNewPassword] = useState('')
@@ -59,7 +59,11 @@ export default function ProfilePage() {
     setChangingPassword(true)
 
     try {
-      await authAPI.changePassword(currentPassword, newPassword)
+      const response = await authAPI.changePassword(currentPassword, newPassword)
+      // Changing the password revokes old tokens; keep this session on the new ones
+      if (user) {
+        setUser({ ...user, token: response.data.token, refresh_token: response.data.refresh_token })
+      }
       setPasswordSuccess('Password changed successfully')
       setCurrentPassword('')
       setNewPassword('')
@@ -87,6 +91,7 @@ export default function ProfilePage() {
   }
 
   const handleLogout = () => {
+    authAPI.logout().catch(() => {})
     logout()
     router.push('/login')
   }
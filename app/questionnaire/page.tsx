@@ -3,7 +3,7 @@
 import { useState, useEffect } from 'react'
 import { useRouter } from 'next/navigation'
 import { useAuthStore } from '@/lib/store'
-import { questionnaireAPI, babiesAPI, settingsAPI } from '@/lib/api'
+import { questionnaireAPI, babiesAPI, settingsAPI, authAPI } from '@/lib/api'
 import ImageModal from '../components/ImageModal'
 import ProfileTabs from '@/app/components/ProfileTabs'
 
@@ -116,6 +116,7 @@ export default function QuestionnairePage() {
   }
 
   const handleLogout = () => {
+    authAPI.logout().catch(() => {})
     logout()
     router.push('/login')
   }
@@ -0,0 +1,75 @@
+"""
+Benchmark response compression on representative API payloads.
+
+Reports bytes saved and CPU cost per encoding/level for the largest
+responses the API produces (admin questionnaire list, chat history).
+
+Usage (from the repo root):
+    python -m benchmarks.compression [--users 500] [--messages 200]
+"""
+
+import argparse
+import json
+import time
+from api.compression import available_encodings, compress_body
+
+def questionnaires_payload(users):
+    """Shape of GET /api/questionnaires/all"""
+    return [{
+        'user_id': i,
+        'email': f'user{i}@example.com',
+        'answers': {
+            'q1': 'Somewhere between the mountains and the sea',
+            'q2': ['curious', 'kind', 'funny'],
+            'q3': 'We would love a baby who enjoys music, books and long walks.',
+            'q4': i % 5
+        },
+        'image_paths': [f'{i}_photo.jpg'],
+        'updated_at': '2026-01-01T12:00:00'
+    } for i in range(users)]
+
+def chat_history_payload(messages):
+    """Shape of GET /api/chat/<baby_id>"""
+    return {
+        'messages': [{
+            'message': 'Goo goo! I love when you read me stories about the moon and the stars.',
+            'role': 'user' if i % 2 == 0 else 'assistant',
+            'timestamp': '2026-01-01T12:00:00'
+        } for i in range(messages)],
+        'message_count': messages
+    }
+
+def measure(data, encoding, level, rounds):
+    start = time.process_time()
+    for _ in range(rounds):
+        compressed = compress_body(data, encoding, level=level, br_quality=level)
+    cpu_ms = (time.process_time() - start) * 1000 / rounds
+    return len(compressed), cpu_ms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    payloads = {
+        'questionnaires/all': questionnaires_payload(args.users),
+        'chat history': chat_history_payload(args.messages),
+    }
+    levels = {'gzip': (1, 6, 9), 'br': (1, 4, 11)}
+
+    print(f"{'payload':<20} {'encoding':<8} {'level':>5} {'raw':>10} {'encoded':>10} {'saved':>7} {'cpu ms':>8}")
+    for name, payload in payloads.items():
+        data = json.dumps(payload).encode()
+        for encoding in available_encodings():
+            for level in levels[encoding]:
+                size, cpu_ms = measure(data, encoding, level, args.rounds)
+                saved = 100 * (1 - size / len(data))
+                print(f'{name:<20} {encoding:<8} {level:>5} {len(data):>10} {size:>10} {saved:>6.1f}% {cpu_ms:>8.2f}')
+
+    if 'br' not in available_encodings():
+        print('\nbrotli is not installed; only gzip was measured (pip install brotli to enable br)')
+
+if __name__ == '__main__':
+    main()
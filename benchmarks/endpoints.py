@@ -0,0 +1,172 @@
+"""
+Query-count and latency budgets per API endpoint.
+
+Runs every endpoint below against an ephemeral Postgres database with a
+fake model (see benchmarks/harness.py) and fails when an endpoint runs
+more SQL statements or takes longer than its budget. Query counts are
+exact and machine independent, so a new N+1 loop or an extra round trip
+shows up as a failure. Latency is the p95 over --rounds requests, not
+counting the fake model's --llm-latency, and is meant to catch
+order-of-magnitude regressions rather than small jitter.
+
+It also checks that the hot queries can be served by their indexes.
+
+Usage (from the repo root; needs BENCH_DATABASE_URL or pip install pgserver):
+    python -m benchmarks.endpoints [--rounds 20] [--llm-latency 0.05] [--verbose]
+"""
+
+import argparse
+import io
+import itertools
+import statistics
+import sys
+from .harness import Harness
+
+# Smallest valid PNG (1x1, transparent)
+PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c63000100000500010d0a2db40000000049454e44ae426082'
+)
+
+def _image():
+    """Multipart body for the upload endpoint; a new stream per request since each one consumes it"""
+    return {'image': (io.BytesIO(PNG), 'bench.png')}
+
+# (name, role, method, path, json body, max statements, p95 ms budget)
+# {baby_id} is the first seeded baby, {baby_ids} all of them, {n} a number unique to each request.
+# A callable body returns multipart form data instead of JSON.
+ENDPOINTS = [
+    ('health', None, 'GET', '/api/health', None, 0, 20),
+    ('register', None, 'POST', '/api/auth/register', {'email': 'bench-new-{n}@example.com', 'password': Harness.PASSWORD}, 2, 500),
+    ('login', None, 'POST', '/api/auth/login', {'email': Harness.USER_EMAIL, 'password': Harness.PASSWORD}, 1, 500),
+    ('me', 'user', 'GET', '/api/auth/me', None, 1, 50),
+    ('partner', 'user', 'POST', '/api/auth/partner', {'partner': 'Sam'}, 2, 50),
+    ('refresh', 'guest-refresh', 'POST', '/api/auth/refresh', None, 0, 20),
+    ('change password', 'guest', 'POST', '/api/auth/change-password',
+     {'current_password': Harness.PASSWORD, 'new_password': Harness.PASSWORD}, 2, 1000),
+    ('logout', 'guest', 'POST', '/api/auth/logout', None, 1, 50),
+    ('settings', 'user', 'GET', '/api/settings', None, 1, 50),
+    ('questionnaire', 'user', 'GET', '/api/questionnaire', None, 2, 50),
+    ('questionnaire save', 'user', 'POST', '/api/questionnaire', {'answers': {'q1': 'By the sea'}}, 3, 50),
+    ('questionnaire upload', 'user', 'POST', '/api/questionnaire/upload', _image, 4, 50),
+    ('babies', 'user', 'GET', '/api/babies', None, 2, 50),
+    ('select baby', 'user', 'POST', '/api/babies/selected', {'baby_id': '{baby_id}'}, 2, 50),
+    ('selected baby', 'user', 'GET', '/api/babies/selected', None, 2, 50),
+    ('my babies', 'user', 'GET', '/api/babies/my-babies', None, 2, 50),
+    ('bootstrap', 'user', 'GET', '/api/bootstrap', None, 3, 80),
+    ('chat history', 'user', 'GET', '/api/chat/{baby_id}', None, 4, 50),
+    ('chat send', 'user', 'POST', '/api/chat/{baby_id}', {'message': 'Hi little one!'}, 10, 100),
+    ('chat multi', 'user', 'POST', '/api/chat/multi', {'message': 'Who wants a story?', 'baby_ids': '{baby_ids}'}, 12, 150),
+    ('all questionnaires', 'admin', 'GET', '/api/questionnaires/all', None, 2, 80),
+    ('users', 'admin', 'GET', '/api/auth/users', None, 2, 80),
+    ('save settings', 'admin', 'POST', '/api/settings', {'settings': {'questionnaires_locked': False}}, 2, 50),
+    ('questionnaire lock', 'admin', 'POST', '/api/settings/questionnaires-lock', {'is_locked': False}, 2, 50),
+    ('create baby', 'admin', 'POST', '/api/babies',
+     {'name': 'Bench {n}', 'age': '1 year', 'attributes': ['calm'], 'life_stages': []}, 2, 50),
+    ('update baby', 'admin', 'PUT', '/api/babies/{baby_id}', {'attributes': ['smart', 'curious', 'giggly']}, 2, 50),
+    ('assign baby', 'admin', 'POST', '/api/babies/{baby_id}/assign', {'user_id': '{user_id}'}, 2, 50),
+    ('assign babies', 'admin', 'POST', '/api/babies/assignments',
+     {'assignments': [{'baby_id': '{baby_id}', 'user_id': '{user_id}'}]}, 3, 50),
+    ('visibility', 'admin', 'POST', '/api/babies/visibility', {'is_visible': True}, 2, 50),
+    ('visibility batch', 'admin', 'POST', '/api/babies/visibility/batch', {'baby_ids': '{baby_ids}', 'is_visible': True}, 3, 50),
+    ('search users', 'admin', 'GET', '/api/admin/search/users?email=bench', None, 2, 80),
+    ('search questionnaires', 'admin', 'GET', '/api/admin/search/questionnaires?q=sea', None, 2, 80),
+    ('search messages', 'admin', 'GET', '/api/admin/search/messages?q=little', None, 2, 80),
+    ('search babies', 'admin', 'GET', '/api/admin/search/babies?attribute=smart', None, 2, 80),
+    ('usage report', 'admin', 'GET', '/api/admin/usage?group_by=baby', None, 3, 80),
+    ('usage quota', 'admin', 'POST', '/api/admin/usage/quota', {'user_id': '{user_id}', 'token_quota': None}, 2, 50),
+    # The harness ends change streams after their opening events, so this measures the setup
+    ('changes', 'admin', 'GET', '/api/admin/changes', None, 2, 50),
+]
+
+# (name, sql, params, index the plan must use); params may reference {user_id} and {baby_id}
+# chat_messages partitions name their copy of idx_chat_messages_conversation after its columns
+PLANS = [
+    ('my babies', None, ('{user_id}',), 'idx_user_babies_active'),
+    ('chat history',
+     'SELECT id, message, role, created_at FROM chat_messages WHERE user_id = %s AND baby_id = %s ORDER BY id',
+     ('{user_id}', '{baby_id}'), '_user_id_baby_id_id_idx'),
+]
+
+def _fill(value, ids):
+    if isinstance(value, dict):
+        return {k: _fill(v, ids) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill(v, ids) for v in value]
+    if isinstance(value, str) and value.startswith('{') and value.endswith('}') and value[1:-1] in ids:
+        return ids[value[1:-1]]
+    if isinstance(value, str):
+        return value.format(**ids)
+    return value
+
+def p95(samples):
+    return statistics.quantiles(samples, n=20)[-1] if len(samples) > 1 else samples[0]
+
+def check_endpoints(h, rounds, verbose=False):
+    """Run each endpoint `rounds` times; returns a list of failure messages"""
+    ids = {'baby_id': h.baby_ids[0], 'baby_ids': h.baby_ids, 'user_id': h.user_id}
+    counter = itertools.count(1)
+    failures = []
+
+    print(f"{'endpoint':<22} {'status':>6} {'queries':>9} {'p50 ms':>8} {'p95 ms':>8} {'budget':>8}")
+    for name, role, method, template, body, max_queries, budget_ms in ENDPOINTS:
+        timings, most = [], []
+        for _ in range(rounds):
+            ids['n'] = next(counter)
+            path = _fill(template, ids)
+            kwargs = {'data': body()} if callable(body) else {'json': _fill(body, ids)}
+            response, statements, elapsed_ms = h.request(role, method, path, **kwargs)
+            if response.status_code >= 400:
+                failures.append(f'{name}: {method} {path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}')
+                break
+            timings.append(elapsed_ms)
+            if len(statements) > len(most):
+                most = statements
+        if not timings:
+            continue
+
+        latency = p95(timings)
+        print(f'{name:<22} {response.status_code:>6} {len(most):>4} / {max_queries:<2} '
+              f'{statistics.median(timings):>8.1f} {latency:>8.1f} {budget_ms:>8}')
+        if verbose:
+            for statement in most:
+                print('    ' + ' '.join(statement.split())[:140])
+
+        if len(most) > max_queries:
+            failures.append(f'{name}: {len(most)} statements, budget {max_queries}')
+        if latency > budget_ms:
+            failures.append(f'{name}: p95 {latency:.1f} ms, budget {budget_ms} ms')
+    return failures
+
+def check_plans(h):
+    """Returns a list of failure messages for queries whose plan cannot use the expected index"""
+    from api.babies import MY_BABIES_QUERY
+
+    ids = {'baby_id': h.baby_ids[0], 'user_id': h.user_id}
+    failures = []
+    for name, sql, params, index in PLANS:
+        plan = h.explain(sql or MY_BABIES_QUERY, tuple(_fill(p, ids) for p in params))
+        if index not in plan:
+            failures.append(f'{name}: plan does not use {index}:\n{plan}')
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='seconds per fake model call')
+    parser.add_argument('--verbose', action='store_true', help='print the statements of each endpoint')
+    args = parser.parse_args()
+
+    with Harness(llm_latency=args.llm_latency) as h:
+        failures = check_endpoints(h, args.rounds, args.verbose) + check_plans(h)
+        print(f'\nfake model: {len(h.llm.calls)} calls')
+
+    if failures:
+        print('\nFAILED')
+        for failure in failures:
+            print(f'- {failure}')
+        sys.exit(1)
+    print('All endpoints within budget')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""
+Fixtures for contract and regression checks against the real API code.
+
+- ephemeral_database(): a new empty Postgres database, dropped afterwards.
+  It is created on the server at BENCH_DATABASE_URL, or on a throwaway
+  server started with pgserver (pip install pgserver) when that is unset.
+  The app runs real SQL, so plans, constraints and partitions behave as
+  in production.
+- FakeAnthropic: a deterministic stand-in for the Anthropic client with
+  configurable latency and token counts, installed with llm.set_client().
+- QueryLog: counts the statements each request runs on its own thread
+  (background tasks such as usage flushes and summaries are not counted)
+  and the databases they ran on.
+- Harness: ties them together. It runs init_db and seed_babies, makes
+  the seeded babies visible, and logs in a user, the admin and a guest.
+  The guest gets fresh tokens on every request, so endpoints that revoke
+  tokens (logout, change-password) can be run repeatedly. With replicas=N
+  it also creates N replica databases for DATABASE_REPLICA_URLS; they get
+  a copy of the primary's data at setup and on sync_replicas(), which
+  stands in for replication (and its lag).
+
+Usage:
+    with Harness(llm_latency=0.05) as h:
+        response, statements, elapsed_ms = h.request('user', 'GET', '/api/babies/my-babies')
+"""
+
+import contextlib
+import hashlib
+import io
+import itertools
+import os
+import tempfile
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+class FakeAnthropic:
+    """messages.create() with a fixed latency, token counts and a reply derived from the prompt
+
+    input_tokens=None estimates from the prompt size (4 characters per token).
+    """
+
+    def __init__(self, latency=0.0, input_tokens=None, output_tokens=20, cache_read_tokens=0):
+        self.latency = latency
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cache_read_tokens = cache_read_tokens
+        self.calls = []
+        self.spans = []  # (start, end) perf_counter times of each call's latency
+        self._lock = threading.Lock()
+
+    @property
+    def messages(self):
+        return self
+
+    def create(self, model, max_tokens, messages, system=None, **kwargs):
+        with self._lock:
+            self.calls.append({'model': model, 'max_tokens': max_tokens, 'system': system, 'messages': messages, **kwargs})
+            call_id = len(self.calls)
+        if self.latency:
+            start = time.perf_counter()
+            time.sleep(self.latency)
+            with self._lock:
+                self.spans.append((start, time.perf_counter()))
+
+        prompt = f'{system}\n' + '\n'.join(f"{m['role']}: {m['content']}" for m in messages)
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        input_tokens = self.input_tokens if self.input_tokens is not None else max(1, len(prompt) // 4)
+        return SimpleNamespace(
+            id=f'msg_fake_{call_id}',
+            model=model,
+            role='assistant',
+            stop_reason='end_turn',
+            content=[SimpleNamespace(type='text', text=f'Goo goo! ({digest})')],
+            usage=SimpleNamespace(
+                input_tokens=input_tokens,
+                output_tokens=min(self.output_tokens, max_tokens),
+                cache_read_input_tokens=self.cache_read_tokens,
+                cache_creation_input_tokens=0
+            )
+        )
+
+class QueryLog:
+    """Statements executed on the current thread inside capture(), and the names of the databases they ran on"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self.databases = set()  # of the last capture()
+
+    def record(self, query, database):
+        statements = getattr(self._local, 'statements', None)
+        if statements is not None:
+            statements.append(query.decode() if isinstance(query, bytes) else str(query))
+            self.databases.add(database)
+
+    @contextlib.contextmanager
+    def capture(self):
+        self._local.statements = statements = []
+        self.databases = set()
+        try:
+            yield statements
+        finally:
+            self._local.statements = None
+
+    def cursor_factory(self):
+        log = self
+
+        class CountingCursor(RealDictCursor):
+            def execute(self, query, vars=None):
+                log.record(query, self.connection.info.dbname)
+                return super().execute(query, vars)
+
+            def executemany(self, query, vars_list):
+                log.record(query, self.connection.info.dbname)
+                return super().executemany(query, vars_list)
+
+        return CountingCursor
+
+@contextlib.contextmanager
+def ephemeral_database(server_url=None):
+    """Yield the URL of a new empty database on server_url (or a throwaway pgserver instance)"""
+    server_url = server_url or os.getenv('BENCH_DATABASE_URL')
+    with contextlib.ExitStack() as stack:
+        if not server_url:
+            try:
+                import pgserver
+            except ImportError:
+                raise RuntimeError('Set BENCH_DATABASE_URL to a Postgres server or pip install pgserver')
+            data_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix='ai-baby-pg-'))
+            server = pgserver.get_server(data_dir, cleanup_mode='stop')
+            stack.callback(server.cleanup)
+            server_url = server.get_uri()
+
+        name = f'bench_{uuid.uuid4().hex[:12]}'
+        admin = psycopg2.connect(server_url)
+        admin.autocommit = True
+        admin.cursor().execute(f'CREATE DATABASE {name}')
+
+        def drop():
+            admin.cursor().execute(f'DROP DATABASE IF EXISTS {name} WITH (FORCE)')
+            admin.close()
+        stack.callback(drop)
+
+        yield psycopg2.extensions.make_dsn(server_url, dbname=name)
+
+def _covered(spans):
+    """Seconds covered by the union of (start, end) spans; concurrent model calls count once"""
+    total, reached = 0.0, None
+    for start, end in sorted(spans):
+        if reached is not None and start < reached:
+            start = reached
+        if end > start:
+            total += end - start
+            reached = end
+    return total
+
+class Harness:
+    """The Flask app on an ephemeral database with a fake model and per-request query counts"""
+
+    USER_EMAIL = 'bench-user@example.com'
+    GUEST_EMAIL = 'bench-guest@example.com'
+    PASSWORD = 'bench-password'
+
+    # Copied to replicas in this order
+    REPLICATED_TABLES = ('users', 'babies', 'settings')
+
+    def __init__(self, llm_latency=0.0, input_tokens=None, output_tokens=20, server_url=None, replicas=0):
+        self.llm = FakeAnthropic(llm_latency, input_tokens, output_tokens)
+        self.queries = QueryLog()
+        self.server_url = server_url
+        self.replicas = replicas
+        self._stack = contextlib.ExitStack()
+
+    def __enter__(self):
+        try:
+            self.dsn = self._stack.enter_context(ephemeral_database(self.server_url))
+            self.replica_urls = [
+                self._stack.enter_context(ephemeral_database(self.server_url)) for _ in range(self.replicas)
+            ]
+            self._start(self.dsn)
+        except Exception:
+            self._stack.close()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        from api.tasks import wait_idle
+        from api.usage import usage
+        # Let background jobs finish against the database before it is dropped
+        wait_idle(30)
+        usage.flush()
+        self._stack.close()
+
+    def _start(self, dsn):
+        from api.config import Config
+        from api import database, llm
+
+        # Deterministic runs: no limits, no background greeting jobs;
+        # the change feed returns after its opening events instead of streaming
+        settings = {
+            'DATABASE_URL': dsn,
+            'DATABASE_REPLICA_URLS': self.replica_urls,
+            'PREWARM': False,
+            'RATELIMIT_ENABLED': False,
+            'CHAT_GREETINGS': False,
+            'CHAT_MESSAGE_LIMIT': 0,
+            'TOKEN_QUOTAS': {'user': 0, 'admin': 0},
+            'CHANGE_STREAM_MAX_SECONDS': 0,
+            'UPLOAD_FOLDER': self._stack.enter_context(tempfile.TemporaryDirectory(prefix='ai-baby-uploads-')),
+        }
+        for name, value in settings.items():
+            self._stack.callback(setattr, Config, name, getattr(Config, name))
+            setattr(Config, name, value)
+
+        cursor_factory = self.queries.cursor_factory()
+        original = database.get_db_connection
+        database.get_db_connection = lambda dsn=None: psycopg2.connect(dsn or Config.DATABASE_URL, cursor_factory=cursor_factory)
+        self._stack.callback(setattr, database, 'get_db_connection', original)
+        self._stack.callback(setattr, database, '_replica_cycle', database._replica_cycle)
+        database._replica_cycle = itertools.cycle(self.replica_urls) if self.replica_urls else None
+
+        llm.set_client(self.llm)
+        self._stack.callback(llm.set_client, None)
+
+        from api.index import create_app
+        from api.seed_babies import seed_babies
+        from api.greetings import generate_greetings
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            for url in self.replica_urls:
+                Config.DATABASE_URL = url
+                database.init_db()
+            Config.DATABASE_URL = dsn
+            database.init_db()
+            seed_babies()
+        # As the startup pre-warm does, so the first chat request does not count it
+        database.ensure_current_chat_partitions()
+
+        self.app = create_app(Config, start_prewarm=False)
+        self.client = self.app.test_client()
+        self.headers = {
+            'user': self._login(self.USER_EMAIL),
+            'admin': self._login(Config.ADMIN_EMAIL),
+        }
+        self._login(self.GUEST_EMAIL)
+
+        response = self.client.post('/api/babies/visibility', json={'is_visible': True}, headers=self.headers['admin'])
+        assert response.status_code == 200, response.get_json()
+        self.sync_replicas()
+
+        with database.get_db(readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM babies ORDER BY id')
+            self.baby_ids = [row['id'] for row in cursor.fetchall()]
+            cursor.execute('SELECT id FROM users WHERE email = %s', (self.USER_EMAIL,))
+            self.user_id = cursor.fetchone()['id']
+
+        for baby_id in self.baby_ids:
+            generate_greetings(baby_id)
+
+    def _login(self, email):
+        response = self.client.post('/api/auth/register', json={'email': email, 'password': self.PASSWORD})
+        if response.status_code != 201:
+            response = self.client.post('/api/auth/login', json={'email': email, 'password': self.PASSWORD})
+        assert response.status_code in (200, 201), response.get_json()
+        return {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+    def sync_replicas(self):
+        """Copy REPLICATED_TABLES from the primary to every replica, as replication would"""
+        for url in self.replica_urls:
+            with contextlib.closing(psycopg2.connect(self.dsn)) as source, contextlib.closing(psycopg2.connect(url)) as target:
+                with target:
+                    cursor = target.cursor()
+                    # Like a replication apply worker: no FK or change_log triggers, so table order and
+                    # the users <-> babies reference cycle do not matter
+                    cursor.execute('SET LOCAL session_replication_role = replica')
+                    cursor.execute(f"TRUNCATE {', '.join(self.REPLICATED_TABLES)} CASCADE")
+                    for table in self.REPLICATED_TABLES:
+                        rows = io.StringIO()
+                        source.cursor().copy_expert(f'COPY {table} TO STDOUT', rows)
+                        rows.seek(0)
+                        cursor.copy_expert(f'COPY {table} FROM STDIN', rows)
+
+    def _guest_headers(self, refresh=False):
+        """Newly issued access (or refresh) token for the guest at its current token_version"""
+        from api.database import get_db
+        from api.tokens import issue_tokens
+
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT token_version FROM users WHERE email = %s', (self.GUEST_EMAIL,))
+            version = cursor.fetchone()['token_version']
+        with self.app.app_context():
+            tokens = issue_tokens(self.GUEST_EMAIL, version)
+        return {'Authorization': f"Bearer {tokens['refresh_token' if refresh else 'token']}"}
+
+    def request(self, role, method, path, **kwargs):
+        """Run one request as 'user', 'admin', 'guest', 'guest-refresh' (the guest's refresh token) or None
+
+        Returns (response, statements, ms excluding model latency).
+        """
+        if role in ('guest', 'guest-refresh'):
+            headers = self._guest_headers(refresh=role == 'guest-refresh')
+        else:
+            headers = self.headers[role] if role else {}
+        headers = {**headers, **kwargs.pop('headers', {})}
+        spans = len(self.llm.spans)
+        with self.queries.capture() as statements:
+            start = time.perf_counter()
+            response = self.client.open(path, method=method, headers=headers, **kwargs)
+            response.get_data()
+            elapsed = time.perf_counter() - start
+        return response, statements, max(0.0, elapsed - _covered(self.llm.spans[spans:])) * 1000
+
+    def explain(self, sql, params):
+        """EXPLAIN of a query with sequential scans disabled, so it shows whether an index can serve it"""
+        from api.database import get_db
+        with get_db(readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}', params)
+            return '\n'.join(row['QUERY PLAN'] for row in cursor.fetchall())
@@ -0,0 +1,114 @@
+"""
+Read-replica routing checks.
+
+Runs the app with a primary and a replica database (see Harness in
+benchmarks/harness.py) and checks which database served each request:
+reads go to the replica, writes to the primary, a user who wrote keeps
+reading from the primary for REPLICA_STICKY_SECONDS (through the cookie
+and, for other workers, through the identity), requests that wrote
+nothing or only bookkeeping rows do not start that, and an unreachable
+replica falls back to the primary.
+
+Without BENCH_DATABASE_URL each database runs on its own throwaway
+pgserver instance, i.e. two local Postgres servers.
+
+Usage (from the repo root; needs BENCH_DATABASE_URL or pip install pgserver):
+    python -m benchmarks.replicas
+"""
+
+import argparse
+import itertools
+import sys
+from types import SimpleNamespace
+import psycopg2
+from .harness import Harness
+
+def _sticky(response):
+    from api.database import STICKY_COOKIE
+    return any(c.startswith(f'{STICKY_COOKIE}=') for c in response.headers.getlist('Set-Cookie'))
+
+def _forget_writes(h):
+    """Drop read-your-writes state: the client's cookie and this worker's memory of recent writers"""
+    from api import database
+    h.client.delete_cookie(database.STICKY_COOKIE)
+    database._recent_writers.clear()
+
+def check_routing(h):
+    """Returns a list of failure messages"""
+    from api import database
+    from api.usage import usage
+
+    primary = psycopg2.extensions.parse_dsn(h.dsn)['dbname']
+    replica = psycopg2.extensions.parse_dsn(h.replica_urls[0])['dbname']
+    names = {primary: 'primary', replica: 'replica'}
+    failures = []
+
+    def check(name, role, method, path, expected, sticky=False, **kwargs):
+        """expected: the database(s) the request may use; sticky: whether it should set the cookie"""
+        expected = sorted([expected] if isinstance(expected, str) else expected)
+        response, _, _ = h.request(role, method, path, **kwargs)
+        served = sorted(names.get(d, d) for d in h.queries.databases)
+        print(f"{name:<44} {response.status_code:>6} {', '.join(served):>16} {'yes' if _sticky(response) else 'no':>7}")
+        if served != expected or _sticky(response) != sticky:
+            failures.append(f"{name}: served by {served or 'nothing'} (sticky cookie: {_sticky(response)}), "
+                            f"expected {expected} (sticky cookie: {sticky})")
+        return response
+
+    def check_not_sticky(name):
+        if database._recent_writers:
+            failures.append(f'{name}: made {", ".join(database._recent_writers)} read from the primary')
+
+    _forget_writes(h)
+    print(f"{'check':<44} {'status':>6} {'database':>16} {'cookie':>7}")
+    check('read', 'user', 'GET', '/api/auth/me', 'replica')
+    check('write', 'user', 'POST', '/api/auth/partner', 'primary', sticky=True, json={'partner': 'Sam'})
+
+    response = check('read after write (cookie)', 'user', 'GET', '/api/auth/me', 'primary')
+    if response.get_json().get('partner') != 'Sam':
+        failures.append('read after write (cookie): did not see the write')
+
+    h.client.delete_cookie(database.STICKY_COOKIE)
+    check('read after write (same worker, no cookie)', 'user', 'GET', '/api/auth/me', 'primary')
+
+    _forget_writes(h)
+    response = check('read once the stickiness expired', 'user', 'GET', '/api/auth/me', 'replica')
+    if response.get_json().get('partner') == 'Sam':
+        failures.append('read once the stickiness expired: the replica should not have the write before a sync')
+
+    # A read-write block that returns before writing (403) is not a write
+    check('rejected write', 'user', 'POST', '/api/babies/visibility', 'primary', json={'is_visible': False})
+    check_not_sticky('rejected write')
+
+    # Flushing buffered usage writes to the primary, but it is bookkeeping the admin does not read back
+    call = SimpleNamespace(usage=SimpleNamespace(input_tokens=10, output_tokens=5))
+    usage.record(h.user_id, h.baby_ids[0], 'bench-model', 'chat', call)
+    check('usage report (flushes buffered usage)', 'admin', 'GET', '/api/admin/usage', ('primary', 'replica'))
+    check_not_sticky('usage report')
+
+    # An unreachable replica is skipped for REPLICA_RETRY_SECONDS
+    unreachable = psycopg2.extensions.make_dsn(h.replica_urls[0], dbname=f'{replica}_missing')
+    cycle = database._replica_cycle
+    database._replica_cycle = itertools.cycle([unreachable])
+    try:
+        check('read with the replica down', 'user', 'GET', '/api/auth/me', 'primary')
+    finally:
+        database._replica_cycle = cycle
+        database._replica_down_until.pop(unreachable, None)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    with Harness(replicas=1) as h:
+        failures = check_routing(h)
+
+    if failures:
+        print('\nFAILED')
+        for failure in failures:
+            print(f'- {failure}')
+        sys.exit(1)
+    print('\nReplica routing OK')
+
+if __name__ == '__main__':
+    main()
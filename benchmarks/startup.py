@@ -0,0 +1,61 @@
+"""
+Benchmark cold start: import time and time to first response.
+
+Each run starts a fresh interpreter, imports api.index and serves
+GET /api/health through the test client, so the numbers match what a
+new serverless instance or gunicorn worker pays. It also reports which
+heavy modules were imported eagerly, to catch lazy-import regressions.
+
+Usage (from the repo root):
+    python -m benchmarks.startup [--runs 10]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ('anthropic', 'PIL', 'dotenv')
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import api.index
+imported = time.perf_counter()
+response = api.index.app.test_client().get('/api/health')
+assert response.status_code == 200, response.status_code
+first_response = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_response_ms': (first_response - start) * 1000,
+    'eager': [m for m in %r if m in sys.modules],
+}))
+'''
+
+def run_once(env):
+    out = subprocess.run(
+        [sys.executable, '-c', CHILD % (HEAVY_MODULES,)],
+        capture_output=True, text=True, env=env, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    # Measure the app itself: no background pre-warm competing for the import lock
+    env = {**os.environ, 'PREWARM': 'false'}
+    results = [run_once(env) for _ in range(args.runs)]
+
+    for key in ('import_ms', 'first_response_ms'):
+        values = [r[key] for r in results]
+        print(f'{key:<18} median {statistics.median(values):8.1f}  min {min(values):8.1f}  max {max(values):8.1f}')
+
+    eager = sorted({m for r in results for m in r['eager']})
+    print(f"eagerly imported heavy modules: {', '.join(eager) if eager else 'none'}")
+
+if __name__ == '__main__':
+    main()
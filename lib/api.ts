@@ -1,4 +1,5 @@
 import axios from 'axios'
+import { useAuthStore } from './store'
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || '/api'
 
@@ -23,10 +24,53 @@ api.interceptors.request.use((config) => {
   return Promise.reject(error)
 })
 
+// Access tokens are short-lived: on a 401, swap the refresh token for a new one and retry once
+let refreshing: Promise<string | null> | null = null
+
+const refreshAccessToken = async (): Promise<string | null> => {
+  const { user, setUser } = useAuthStore.getState()
+  if (!user?.refresh_token) return null
+  try {
+    const response = await axios.post(`${API_URL}/auth/refresh`, null, {
+      headers: { Authorization: `Bearer ${user.refresh_token}` },
+    })
+    setUser({ ...user, token: response.data.token })
+    return response.data.token
+  } catch {
+    setUser(null)
+    return null
+  }
+}
+
+// Writes that carry an Idempotency-Key can be retried safely: the server replays the first result
+const idempotent = (config: any = {}) => ({
+  ...config,
+  headers: { ...config.headers, 'Idempotency-Key': crypto.randomUUID() },
+})
+
+const MAX_NETWORK_RETRIES = 2
+
+api.interceptors.response.use((response) => response, async (error) => {
+  const original = error.config
+  if (!error.response && original?.headers?.['Idempotency-Key'] && (original._attempts || 0) < MAX_NETWORK_RETRIES) {
+    original._attempts = (original._attempts || 0) + 1
+    return api(original)
+  }
+  if (error.response?.status !== 401 || !original || original._retried) {
+    return Promise.reject(error)
+  }
+  original._retried = true
+  refreshing = refreshing || refreshAccessToken().finally(() => { refreshing = null })
+  const token = await refreshing
+  if (!token) return Promise.reject(error)
+  original.headers.Authorization = `Bearer ${token}`
+  return api(original)
+})
+
 // Auth endpoints
 export const authAPI = {
   register: (email: string, password: string) =>
-    api.post('/auth/register', { email, password }),
+    api.post('/auth/register', { email, password }, idempotent()),
   login: (email: string, password: string) =>
     api.post('/auth/login', { email, password }),
   getMe: () => api.get('/auth/me'),
@@ -36,16 +80,17 @@ export const authAPI = {
   ,
   updatePartner: (partner: string) => api.post('/auth/partner', { partner }),
   getAllUsers: () => api.get('/auth/users'),
+  logout: () => api.post('/auth/logout'),
 }
 
 // Questionnaire endpoints
 export const questionnaireAPI = {
   get: () => api.get('/questionnaire'),
-  save: (answers: any) => api.post('/questionnaire', { answers }),
+  save: (answers: any) => api.post('/questionnaire', { answers }, idempotent()),
   upload: (formData: FormData) =>
-    api.post('/questionnaire/upload', formData, {
+    api.post('/questionnaire/upload', formData, idempotent({
       headers: { 'Content-Type': 'multipart/form-data' },
-    }),
+    })),
   getAll: () => api.get('/questionnaires/all'),
 }
 
@@ -58,20 +103,155 @@ export const babiesAPI = {
   select: (baby_id: number) => api.post('/babies/selected', { baby_id }),
   getSelected: () => api.get('/babies/selected'),
   create: (data: any) => api.post('/babies', data),
+  update: (baby_id: number, data: any) => api.put(`/babies/${baby_id}`, data),
   assignToUser: (baby_id: number, user_id: number) =>
     api.post(`/babies/${baby_id}/assign`, { baby_id, user_id }),
+  assignMany: (assignments: { baby_id: number; user_id: number }[]) =>
+    api.post('/babies/assignments', { assignments }),
+  setVisibilityMany: (baby_ids: number[], is_visible: boolean) =>
+    api.post('/babies/visibility/batch', { baby_ids, is_visible }),
 }
 
 // Chat endpoints
 export const chatAPI = {
-  getHistory: (babyId: number) => api.get(`/chat/${babyId}`),
-  sendMessage: (babyId: number, message: string, stage?: any) =>
-    api.post(`/chat/${babyId}`, { message, stage }),
+  getHistory: (babyId: number, stageIndex?: number | null) =>
+    api.get(`/chat/${babyId}`, { params: stageIndex != null ? { stage_index: stageIndex } : undefined }),
+  sendMessage: (babyId: number, message: string, stageIndex?: number | null) =>
+    api.post(`/chat/${babyId}`, { message, stage_index: stageIndex ?? null }, idempotent()),
+  // Ask several babies at once; onReply fires as each answer arrives (NDJSON stream)
+  sendMulti: async (
+    babyIds: number[],
+    message: string,
+    onReply: (reply: MultiReply) => void,
+    stageIndex?: number | null,
+  ): Promise<number[]> => {
+    const token = useAuthStore.getState().user?.token
+    const response = await fetch(`${API_URL}/chat/multi`, {
+      method: 'POST',
+      headers: { Authorization: `Bearer ${token}`, 'Content-Type': 'application/json' },
+      body: JSON.stringify({ message, baby_ids: babyIds, stage_index: stageIndex ?? null }),
+    })
+    if (!response.ok || !response.body) {
+      const error = await response.json().catch(() => ({}))
+      throw Object.assign(new Error(error.error || `Chat failed: ${response.status}`), { response: { status: response.status, data: error } })
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    let saved: number[] = []
+    while (true) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      const lines = buffer.split('\n')
+      buffer = lines.pop() || ''
+      for (const line of lines) {
+        if (!line) continue
+        const data = JSON.parse(line)
+        if (data.done) saved = data.saved
+        else onReply(data)
+      }
+    }
+    return saved
+  },
+}
+
+export interface MultiReply {
+  baby_id: number
+  message?: string
+  message_count?: number
+  limit_reached?: boolean
+  error?: string
+}
+
+// Page-load bootstrap: me, settings, questionnaire, babies, selected_baby, my_babies in one call
+export const bootstrapAPI = {
+  get: (fields?: string[]) =>
+    api.get('/bootstrap', { params: fields ? { fields: fields.join(',') } : undefined }),
+}
+
+// Admin search endpoints (keyset paginated: pass next_cursor back as cursor)
+export const searchAPI = {
+  users: (params: Record<string, any>) => api.get('/admin/search/users', { params }),
+  questionnaires: (params: Record<string, any>) => api.get('/admin/search/questionnaires', { params }),
+  messages: (params: Record<string, any>) => api.get('/admin/search/messages', { params }),
+  babies: (params: Record<string, any>) => api.get('/admin/search/babies', { params }),
+}
+
+// Admin change feed: server-sent row deltas for users, questionnaires, babies and chat_sessions.
+// Uses fetch rather than EventSource so the Authorization header can be sent; reconnects with the last cursor.
+export interface Change {
+  id: number
+  table: 'users' | 'questionnaires' | 'babies' | 'chat_sessions'
+  op: 'INSERT' | 'UPDATE' | 'DELETE'
+  row_id: number
+  row: any | null
+  at: string
+}
+
+export const changesAPI = {
+  subscribe: (
+    tables: Change['table'][],
+    handlers: { onReady?: () => void; onChange: (change: Change) => void; onReset?: () => void },
+  ) => {
+    const controller = new AbortController()
+    let cursor: string | null = null
+
+    const connect = async () => {
+      while (!controller.signal.aborted) {
+        try {
+          const token = useAuthStore.getState().user?.token
+          const params = new URLSearchParams({ tables: tables.join(',') })
+          if (cursor) params.set('cursor', cursor)
+          const response = await fetch(`${API_URL}/admin/changes?${params}`, {
+            headers: { Authorization: `Bearer ${token}` },
+            signal: controller.signal,
+          })
+          if (response.status === 401) {
+            // Let the axios interceptor refresh the access token before reconnecting
+            await api.get('/auth/me').catch(() => {})
+          }
+          if (!response.ok || !response.body) throw new Error(`Change feed failed: ${response.status}`)
+
+          const reader = response.body.getReader()
+          const decoder = new TextDecoder()
+          let buffer = ''
+          while (true) {
+            const { value, done } = await reader.read()
+            if (done) break
+            buffer += decoder.decode(value, { stream: true })
+            const events = buffer.split('\n\n')
+            buffer = events.pop() || ''
+            for (const block of events) {
+              const fields: Record<string, string> = {}
+              for (const line of block.split('\n')) {
+                const i = line.indexOf(': ')
+                if (i > 0) fields[line.slice(0, i)] = line.slice(i + 2)
+              }
+              if (fields.id) cursor = fields.id
+              if (fields.event === 'ready') handlers.onReady?.()
+              else if (fields.event === 'reset') handlers.onReset?.()
+              else if (fields.event === 'change') handlers.onChange(JSON.parse(fields.data))
+            }
+          }
+        } catch (err) {
+          if (controller.signal.aborted) return
+          console.error('Change feed disconnected:', err)
+        }
+        await new Promise((resolve) => setTimeout(resolve, 3000))
+      }
+    }
+
+    connect()
+    return () => controller.abort()
+  },
 }
 
 // Settings endpoints
 export const settingsAPI = {
   get: () => api.get('/settings'),
+  update: (settings: Record<string, boolean>) => api.post('/settings', { settings }),
   toggleQuestionnairesLock: (is_locked: boolean) =>
     api.post('/settings/questionnaires-lock', { is_locked }),
 }
@@ -5,6 +5,7 @@ interface User {
   email: string
   role: string
   token: string
+  refresh_token?: string
   selected_baby_id?: number
 }
 